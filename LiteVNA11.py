@@ -2,6 +2,8 @@ import serial
 import struct
 import numpy as np
 import matplotlib.pyplot as plt
+from LiteVNA_S11 import s11_from_fifo
+from LiteVNA_TimeDomain import get_transform
 
 class LiteVNA:
     def __init__(self, port, baudrate=115200, timeout=1):
@@ -83,8 +85,9 @@ def main():
         points = 201
 
         step_freq = (stop_freq - start_freq) // (points - 1)
-        time_resolution = 1 / (stop_freq - start_freq) * points * 1e9  # Convert to nanoseconds
-        time_series = np.linspace(0, time_resolution, points)
+        # Kaiser window, zero padding and time axis are prepared once for this sweep
+        transform = get_transform(start_freq, step_freq, points)
+        time_series = transform.times * 1e9  # Convert to nanoseconds
 
         averages = 2
         litevna.configure_sweep(start_freq, step_freq, points, averages)
@@ -92,9 +95,12 @@ def main():
         print("Initializing real-time time-domain plot...")
         plt.ion()
         fig, ax = plt.subplots()
-        line, = ax.plot(time_series, np.zeros(points), label="Time-Domain Signal")
+        line, = ax.plot(time_series, np.zeros(transform.fft_points), label="Time-Domain Signal")
         ax.set_xlabel("Time (ns)")
-        ax.set_ylabel("Amplitude")
+        ax.set_ylabel("Reflection (linear)")
+        # The transform keeps a reflection at its |S11|, which is at most 1 on a passive port,
+        # so the limits are fixed instead of recomputed from every frame
+        ax.set_ylim(0, 1.05)
         ax.set_title("Real-Time Time-Domain Signal")
         ax.legend()
         ax.grid()
@@ -107,22 +113,13 @@ def main():
                 print(f"Error: Expected {32 * points} bytes, received {len(fifo_data)} bytes")
                 continue
 
-            s11_values = []
-            for i in range(points):
-                data = fifo_data[i * 32 : (i + 1) * 32]
-                s11_values.append(litevna.get_s11_complex(data))
+            s11_values, magnitude, magnitude_db, phase = s11_from_fifo(fifo_data)
 
-            # Convert Frequency Domain to Time Domain using IFFT
-            time_signal = np.abs(np.fft.ifft(s11_values))
-            time_signal = time_signal / np.max(time_signal) * 10  # Normalize and scale
-            
-            # Compute scaling range
-            y_min = np.median(time_signal) - 2 * np.std(time_signal)
-            y_max = np.median(time_signal) + 2 * np.std(time_signal)
+            # Convert Frequency Domain to Time Domain using the windowed, zero-padded IFFT
+            time_signal = transform.magnitude(s11_values)
 
             # Update plot
             line.set_ydata(time_signal)
-            ax.set_ylim(y_min, y_max)
             plt.pause(0.1)
 
     except KeyboardInterrupt:
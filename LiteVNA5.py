@@ -1,7 +1,6 @@
 import serial
-import struct
-import cmath
 import csv
+from LiteVNA_S11 import s11_from_fifo
 
 number_of_values = 100
 
@@ -40,32 +39,6 @@ def read_response(ser, expected_length=1):
         return b''
 
 
-def parse_fifo_block(block):
-    """
-    Parses a 32-byte FIFO block from the LiteVNA.
-
-    Args:
-        block (bytes): A 32-byte data block from the valuesFIFO.
-
-    Returns:
-        dict: Parsed data fields as a dictionary.
-    """
-    if len(block) != 32:
-        raise ValueError("Block size must be 32 bytes.")
-
-    data = {
-        "fwd0Re": struct.unpack('<i', block[0:4])[0],
-        "fwd0Im": struct.unpack('<i', block[4:8])[0],
-        "rev0Re": struct.unpack('<i', block[8:12])[0],
-        "rev0Im": struct.unpack('<i', block[12:16])[0],
-        "rev1Re": struct.unpack('<i', block[16:20])[0],
-        "rev1Im": struct.unpack('<i', block[20:24])[0],
-        "freqIndex": struct.unpack('<H', block[24:26])[0],
-    }
-
-    return data
-
-
 def main():
     # Serial connection parameters
     SERIAL_PORT = "COM3"  # Replace with your serial port
@@ -81,11 +54,8 @@ def main():
             send_command(ser, b'\x18\x30\x64')  # READFIFO for 10 values
             raw_response = read_response(ser, expected_length=number_of_values * 32)  # Expect 10 values, each 32 bytes
 
-            # Parse the response
-            parsed_data = []
-            for i in range(number_of_values):
-                block = raw_response[i * 32:(i + 1) * 32]
-                parsed_data.append(parse_fifo_block(block))
+            # Normalize rev0 with fwd0 and convert to polar for all blocks at once
+            s11, magnitude, magnitude_db, phase = s11_from_fifo(raw_response)
 
             # Prepare CSV output
             csv_filename = "C:/Users/timei/Desktop/litevna_data.csv"
@@ -99,18 +69,7 @@ def main():
                 csv_writer.writerow(header)
 
                 # Write data
-                for entry in parsed_data:
-                    fwd0 = complex(entry["fwd0Re"], entry["fwd0Im"])
-                    rev0 = complex(entry["rev0Re"], entry["rev0Im"])
-
-                    # Normalize rev0 with fwd0
-                    normalized = rev0 / fwd0
-
-                    # Convert to polar
-                    magnitude = abs(normalized)
-                    phase = cmath.phase(normalized)
-
-                    csv_writer.writerow([magnitude, phase])
+                csv_writer.writerows(zip(magnitude.tolist(), phase.tolist()))
 
             print(f"Data saved to {csv_filename}")
 
@@ -1,8 +1,7 @@
 import serial
-import struct
-import cmath
 import csv
 import matplotlib.pyplot as plt
+from LiteVNA_S11 import s11_from_fifo
 
 def send_command(ser, command_bytes):
     """
@@ -39,32 +38,6 @@ def read_response(ser, expected_length=1):
         return b''
 
 
-def parse_fifo_block(block):
-    """
-    Parses a 32-byte FIFO block from the LiteVNA.
-
-    Args:
-        block (bytes): A 32-byte data block from the valuesFIFO.
-
-    Returns:
-        dict: Parsed data fields as a dictionary.
-    """
-    if len(block) != 32:
-        raise ValueError("Block size must be 32 bytes.")
-
-    data = {
-        "fwd0Re": struct.unpack('<i', block[0:4])[0],
-        "fwd0Im": struct.unpack('<i', block[4:8])[0],
-        "rev0Re": struct.unpack('<i', block[8:12])[0],
-        "rev0Im": struct.unpack('<i', block[12:16])[0],
-        "rev1Re": struct.unpack('<i', block[16:20])[0],
-        "rev1Im": struct.unpack('<i', block[20:24])[0],
-        "freqIndex": struct.unpack('<H', block[24:26])[0],
-    }
-
-    return data
-
-
 def main():
     # Serial connection parameters
     SERIAL_PORT = "COM3"  # Replace with your serial port
@@ -86,11 +59,8 @@ def main():
                 send_command(ser, b'\x18\x30' + num_values.to_bytes(2, 'little'))  # READFIFO for 1000 values
                 raw_response = raw_response + read_response(ser, expected_length=num_values * 32)  # Expect 1000 values, each 32 bytes
 
-            # Parse the response
-            parsed_data = []
-            for i in range(num_values * num_reads):
-                block = raw_response[i * 32:(i + 1) * 32]
-                parsed_data.append(parse_fifo_block(block))
+            # Normalize rev0 with fwd0 and convert to polar for all blocks at once
+            s11, magnitude_data, magnitude_db, phase_data = s11_from_fifo(raw_response)
 
             # Prepare CSV output
             csv_filename = "C:/Users/timei/Desktop/litevna_data.csv"
@@ -105,22 +75,7 @@ def main():
                 csv_writer.writerow(header)
 
                 # Write data
-                magnitude_data = []
-                phase_data = []
-                for entry in parsed_data:
-                    fwd0 = complex(entry["fwd0Re"], entry["fwd0Im"])
-                    rev0 = complex(entry["rev0Re"], entry["rev0Im"])
-
-                    # Normalize rev0 with fwd0
-                    normalized = rev0 / fwd0
-
-                    # Convert to polar
-                    magnitude = abs(normalized)
-                    phase = cmath.phase(normalized)
-
-                    magnitude_data.append(magnitude)
-                    phase_data.append(phase)
-                    csv_writer.writerow([magnitude, phase])
+                csv_writer.writerows(zip(magnitude_data.tolist(), phase_data.tolist()))
 
             print(f"Data saved to {csv_filename}")
 
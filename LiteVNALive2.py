@@ -1,11 +1,9 @@
 import serial
-import struct
-import cmath
 import csv
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-import math
 import time
+from LiteVNA_S11 import frequency_grid, s11_from_fifo
 
 def send_command(ser, command_bytes):
     """
@@ -40,31 +38,6 @@ def read_response(ser, expected_length=1):
         print(f"Error reading response: {e}")
         return b''
 
-def parse_fifo_block(block):
-    """
-    Parses a 32-byte FIFO block from the LiteVNA.
-
-    Args:
-        block (bytes): A 32-byte data block from the valuesFIFO.
-
-    Returns:
-        dict: Parsed data fields as a dictionary.
-    """
-    if len(block) != 32:
-        raise ValueError("Block size must be 32 bytes.")
-
-    data = {
-        "fwd0Re": struct.unpack('<i', block[0:4])[0],
-        "fwd0Im": struct.unpack('<i', block[4:8])[0],
-        "rev0Re": struct.unpack('<i', block[8:12])[0],
-        "rev0Im": struct.unpack('<i', block[12:16])[0],
-        "rev1Re": struct.unpack('<i', block[16:20])[0],
-        "rev1Im": struct.unpack('<i', block[20:24])[0],
-        "freqIndex": struct.unpack('<H', block[24:26])[0],
-    }
-
-    return data
-
 def update_plot(frame, ser, line_mag, line_phase, freq_data, magnitude_data_db, phase_data, num_values, start_freq, freq_step):
     try:
         magnitude_data_db.clear()
@@ -74,30 +47,13 @@ def update_plot(frame, ser, line_mag, line_phase, freq_data, magnitude_data_db,
             send_command(ser, b'\x18\x30' + num_values.to_bytes(2, 'little'))
             raw_response = read_response(ser, expected_length=num_values * 32)
 
-            parsed_data = []
-            for i in range(num_values):
-                block = raw_response[i * 32:(i + 1) * 32]
-                parsed_data.append(parse_fifo_block(block))
-
-            for entry in parsed_data:
-                fwd0 = complex(entry["fwd0Re"], entry["fwd0Im"])
-                rev0 = complex(entry["rev0Re"], entry["rev0Im"])
-
-                # Normalize rev0 with fwd0
-                normalized = rev0 / fwd0
-
-                # Convert to polar
-                magnitude = abs(normalized)
-                phase = cmath.phase(normalized)
-
-                # Convert magnitude to dB
-                magnitude_db = 20 * math.log10(magnitude) if magnitude > 0 else -float('inf')
-
-                magnitude_data_db.append(magnitude_db)
-                phase_data.append(phase)
+            # Normalize rev0 with fwd0 and convert to polar for all blocks at once
+            s11, magnitude, magnitude_db, phase = s11_from_fifo(raw_response)
+            magnitude_data_db.extend(magnitude_db)
+            phase_data.extend(phase)
 
         # Update lines
-        freq_data = [start_freq + i * freq_step for i in range(len(magnitude_data_db))]
+        freq_data = frequency_grid(start_freq, freq_step, len(magnitude_data_db)).hz
         line_mag.set_data(freq_data, magnitude_data_db)
         line_phase.set_data(freq_data, phase_data)
 
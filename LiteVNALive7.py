@@ -3,6 +3,7 @@ import serial
 import time
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from LiteVNA_S11 import frequency_grid
 
 class LiteVNA:
     def __init__(self, port, baudrate=9600, timeout=1):
@@ -47,7 +48,7 @@ class LiteVNA:
 
 
 def visualize(litevna, start_freq, step_freq, points):
-    frequencies = [start_freq + i * step_freq for i in range(points)]
+    frequencies = frequency_grid(start_freq, step_freq, points).hz
     s11_magnitudes = [0] * points
 
     fig, ax = plt.subplots()
@@ -3,6 +3,7 @@ import struct
 import time
 import numpy as np
 import matplotlib.pyplot as plt
+from LiteVNA_S11 import frequency_grid
 
 
 class LiteVNA:
@@ -80,7 +81,7 @@ def main():
         print("Initializing real-time plot...")
         plt.ion()
         fig, ax = plt.subplots()
-        freqs = np.linspace(start_freq, stop_freq, points)
+        freqs = frequency_grid(start_freq, step_freq, points).hz
         line, = ax.plot(freqs, np.zeros(points), label="S11 Magnitude (dB)")
         ax.set_xlabel("Frequency (Hz)")
         ax.set_ylabel("S11 Magnitude (dB)")
@@ -2,6 +2,7 @@ import serial
 import struct
 import numpy as np
 import matplotlib.pyplot as plt
+from LiteVNA_S11 import frequency_grid
 
 class LiteVNA:
     def __init__(self, port, baudrate=115200, timeout=1):
@@ -93,7 +94,7 @@ def main():
         print("Initializing real-time plot...")
         plt.ion()
         fig, ax = plt.subplots()
-        freqs = np.linspace(start_freq, stop_freq, points)
+        freqs = frequency_grid(start_freq, step_freq, points).hz
         line, = ax.plot(freqs, np.zeros(points), label="S11 Magnitude (dB)")
         ax.set_xlabel("Frequency (Hz)")
         ax.set_ylabel("S11 Magnitude (dB)")
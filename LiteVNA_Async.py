@@ -0,0 +1,160 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from LiteVNA_Averaging import OutlierRejector
+from LiteVNAforPi_Moisture import CalibrationRegistry, LiteVNASession, decode_sweep, evaluate_sweep, publish_message
+
+
+class AsyncLiteVNA:
+    """
+    asyncio driver built on the LiteVNA command set.
+
+    The serial I/O of a device runs in a worker thread of its own, so the
+    commands stay in order while the event loop is free to decode, publish or
+    store the previous sweep. The worker never waits for a reconnect: a failed
+    connection attempt or a lost connection is raised as
+    serial.SerialException (an IOError), and the next call connects again.
+    sweeps() waits between the attempts like LiteVNASession, but with
+    asyncio.sleep, so it can be cancelled.
+    """
+    def __init__(self, port, baudrate=115200, timeout=1, ser=None, min_backoff=1, max_backoff=60):
+        self.port = port
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.session = LiteVNASession(port, baudrate, timeout, ser=ser, reconnect=False)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"LiteVNA-{port}")
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def open(self):
+        await self._run(self.session.connect)
+        return self
+
+    async def close(self):
+        await self._run(self.session.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    async def configure_sweep(self, start_freq, step_freq, points, averages=2):
+        await self._run(self.session.configure_sweep, start_freq, step_freq, points, averages)
+
+    def _read_sweep(self, start_freq, step_freq, points, averages):
+        fifo_data, missing = self.session.sweep(start_freq, step_freq, points, averages)
+        if missing.all():
+            raise IOError(f"No valid values received out of {points}")
+        return fifo_data, missing
+
+    async def read_sweep(self, start_freq, step_freq, points, averages=2):
+        """
+        Measures one sweep without decoding it.
+
+        Returns:
+            tuple: (fifo_data, missing), the raw FIFO records of the sweep and the
+            mask of the points that could not be recovered, see LiteVNA.read_sweep.
+
+        Raises:
+            serial.SerialException: If the device cannot be reached.
+            IOError: If no valid value was received.
+        """
+        return await self._run(self._read_sweep, start_freq, step_freq, points, averages)
+
+    async def sweep(self, start_freq, step_freq, points, averages=2):
+        """
+        Measures and decodes one sweep.
+
+        Returns:
+            tuple: (s11, s11_magnitude_db, s11_phase) as NumPy arrays, NaN where points are missing.
+
+        Raises:
+            serial.SerialException: If the device cannot be reached.
+            IOError: If no valid value was received.
+        """
+        fifo_data, missing = await self.read_sweep(start_freq, step_freq, points, averages)
+        return decode_sweep(fifo_data, missing)
+
+    async def sweeps(self, start_freq, step_freq, points, averages=2):
+        """
+        Yields decoded sweeps continuously.
+
+        The transfer of the next sweep is started before the current one is
+        handed out, so the consumer's work overlaps with the serial I/O.
+        Sweeps without any valid value are reported and skipped; while the
+        device cannot be reached, it is retried with a growing delay.
+        """
+        backoff = self.min_backoff
+        pending = asyncio.ensure_future(self.sweep(start_freq, step_freq, points, averages))
+        try:
+            while True:
+                try:
+                    result = await pending
+                    backoff = self.min_backoff
+                except serial.SerialException as error:
+                    print(f"No LiteVNA connection ({error}), retrying in {backoff} s")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    result = None
+                except IOError as error:
+                    print(f"Error: {error}")
+                    result = None
+                pending = asyncio.ensure_future(self.sweep(start_freq, step_freq, points, averages))
+                if result is not None:
+                    yield result
+        finally:
+            pending.cancel()
+
+
+async def acquire(port, start_freq, step_freq, points, averages=2, interval=0, device_id="probe1",
+                  calibrations=None):
+    """
+    Moisture acquisition loop of LiteVNAforPi_Moisture.py with overlapping stages.
+
+    While one sweep is evaluated and published, the next one is already read
+    from the device. Sweeps that deviate from the last ones are dropped (OutlierRejector).
+    The moisture is calculated with the calibration of device_id in calibrations
+    (default: a CalibrationRegistry of calibration/), reloaded when its table changes.
+    """
+    loop = asyncio.get_running_loop()
+    # not opened up front: sweeps() connects and keeps retrying while the device is unplugged
+    vna = AsyncLiteVNA(port)
+    rejector = OutlierRejector(points)
+    calibrations = CalibrationRegistry() if calibrations is None else calibrations
+    try:
+        async for s11, s11_magnitude_db, s11_phase in vna.sweeps(start_freq, step_freq, points, averages):
+            if not rejector.accept(s11_magnitude_db):
+                print(f"Warning: sweep rejected, {rejector.outlier_fraction:.0%} of the points deviate from the last sweeps")
+                continue
+            message = evaluate_sweep(s11_magnitude_db, start_freq, step_freq, model=calibrations.get(device_id))
+            print(message)
+            # publishing blocks on the network, keep it away from the event loop and the serial worker
+            await loop.run_in_executor(None, publish_message, message)
+            if interval:
+                await asyncio.sleep(interval)
+    finally:
+        await vna.close()
+
+
+def main():
+    #port = "/dev/ttyUSB0"  # Replace with actual LiteVNA port
+    port = "COM3"
+    start_freq = 1200000000  # 1.2 GHz
+    stop_freq = 2000000000   # 2 GHz
+    points = 201
+    step_freq = (stop_freq - start_freq) // (points - 1)
+    averages = 2
+    try:
+        asyncio.run(acquire(port, start_freq, step_freq, points, averages))
+    except KeyboardInterrupt:
+        print("\nTerminating...")
+
+
+if __name__ == "__main__":
+    main()
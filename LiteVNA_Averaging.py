@@ -0,0 +1,242 @@
+import numpy as np
+
+
+class SweepAverager:
+    """
+    Host-side averaging of consecutive sweeps of one sweep configuration.
+
+    The last `count` sweeps are kept in a preallocated ring buffer together
+    with their running sum, so an update only adds the new sweep and removes
+    the one that drops out: O(points) no matter how large `count` is.
+
+    Modes:
+        "mean": Vector average of the complex S11 of the last `count` sweeps.
+            Noise averages out because its phase is random.
+        "exponential": Vector average with exponentially decaying weights,
+            alpha defaults to 2 / (count + 1).
+        "scalar": Average of |S11| only. Noise does not average out, but the
+            result is immune to phase drift between sweeps.
+
+    NaN values (missing points, see decode_sweep) are left out of the average
+    of their frequency point.
+
+    Args:
+        points (int): Number of points of a sweep.
+        count (int): Number of sweeps in the ring buffer.
+        mode (str): "mean", "exponential" or "scalar".
+        alpha (float): Weight of the newest sweep in "exponential" mode.
+    """
+    def __init__(self, points, count=8, mode="mean", alpha=None):
+        if mode not in ("mean", "exponential", "scalar"):
+            raise ValueError(f"Unknown averaging mode: {mode}")
+        if count < 1:
+            raise ValueError("count must be at least 1.")
+        self.points = points
+        self.count = count
+        self.mode = mode
+        self.alpha = alpha if alpha is not None else 2 / (count + 1)
+        self._ring = np.zeros((count, points), dtype=np.complex128)
+        self._valid = np.zeros((count, points), dtype=bool)
+        self._sum = np.zeros(points, dtype=np.float64 if mode == "scalar" else np.complex128)
+        self._samples = np.zeros(points, dtype=np.int64)
+        self._average = np.full(points, np.nan, dtype=self._sum.dtype)
+        self._index = 0
+        self.filled = 0
+
+    def reset(self):
+        """Forgets all sweeps, e.g. after the sweep configuration changed."""
+        self._valid[:] = False
+        self._sum[:] = 0
+        self._samples[:] = 0
+        self._average[:] = np.nan
+        self._index = 0
+        self.filled = 0
+
+    def _resync(self):
+        # recompute the running sum from the ring from time to time so rounding errors do not accumulate
+        values = np.where(self._valid, self._ring, 0)
+        if self.mode == "scalar":
+            values = np.abs(values)
+        self._sum[:] = values.sum(axis=0)
+
+    def update(self, s11):
+        """
+        Adds a sweep and returns the new average.
+
+        Args:
+            s11 (np.ndarray): Complex S11 with `points` values, NaN where missing.
+
+        Returns:
+            np.ndarray: The averaged complex S11, or the averaged |S11| in "scalar"
+            mode. NaN where no sweep in the buffer has a value.
+        """
+        s11 = np.asarray(s11)
+        if s11.shape != (self.points,):
+            raise ValueError(f"Expected a sweep of {self.points} points, got shape {s11.shape}.")
+        valid = ~np.isnan(s11)
+        slot = self._index
+
+        if self.mode == "exponential":
+            first = valid & np.isnan(self._average)
+            self._average[first] = s11[first]
+            update = valid & ~first
+            self._average[update] += self.alpha * (s11[update] - self._average[update])
+        else:
+            if self.filled == self.count:
+                # remove the oldest sweep, which is overwritten below
+                old = self._valid[slot]
+                oldest = self._ring[slot, old]
+                self._sum[old] -= np.abs(oldest) if self.mode == "scalar" else oldest
+                self._samples -= old
+            new = s11[valid]
+            self._sum[valid] += np.abs(new) if self.mode == "scalar" else new
+            self._samples += valid
+
+        self._ring[slot] = s11
+        self._valid[slot] = valid
+        self._index = (slot + 1) % self.count
+        self.filled = min(self.filled + 1, self.count)
+        if self.mode != "exponential":
+            if self._index == 0:
+                self._resync()
+            self._average[:] = np.nan
+            np.divide(self._sum, self._samples, out=self._average, where=self._samples > 0)
+        return self._average.copy()
+
+    @property
+    def average(self):
+        """The current average, see update()."""
+        return self._average.copy()
+
+    @property
+    def sweeps(self):
+        """The sweeps in the ring buffer from oldest to newest, NaN where missing."""
+        order = (self._index + np.arange(self.filled) - self.filled) % self.count
+        return np.where(self._valid[order], self._ring[order], np.nan)
+
+
+def _row_median(values):
+    # median of every row, np.partition is faster than np.median on small windows
+    n = values.shape[1]
+    k = n // 2
+    if n % 2:
+        return np.partition(values, k, axis=1)[:, k]
+    part = np.partition(values, (k - 1, k), axis=1)
+    return (part[:, k - 1] + part[:, k]) / 2
+
+
+class OutlierRejector:
+    """
+    Rejects whole sweeps that deviate from the recent ones.
+
+    The last `window` accepted sweeps (e.g. S11 in dB) are kept in a ring
+    buffer. A new sweep is compared with their per-frequency median; a point
+    deviates when it is more than `threshold` scaled MADs (median absolute
+    deviation * 1.4826, at least min_mad) away from it. If more than
+    max_fraction of the points deviate, the whole sweep is rejected and not
+    added to the window.
+
+    Checking a sweep is O(points); median and MAD are refreshed every
+    `refresh` accepted sweeps, which is plenty for a window that changes by
+    one sweep at a time.
+
+    A lasting change (the probe really got wetter) would otherwise be rejected
+    forever: after max_rejections rejections in a row the window is restarted
+    from the new sweep. Missing points (NaN) never deviate and are replaced by
+    the median when the sweep is stored.
+
+    Args:
+        points (int): Number of points of a sweep.
+        window (int): Number of accepted sweeps the statistics are taken over.
+        threshold (float): Deviation in scaled MADs above which a point is an outlier.
+        max_fraction (float): Fraction of outlier points above which a sweep is rejected.
+        min_sweeps (int): Sweeps are accepted unchecked until the window holds this many.
+        min_mad (float): Lower bound of the scaled MAD, in the unit of the sweeps.
+        max_rejections (int): Consecutive rejections after which the window restarts.
+        refresh (int): Accepted sweeps between two updates of median and MAD.
+    """
+    def __init__(self, points, window=32, threshold=5.0, max_fraction=0.1, min_sweeps=5, min_mad=0.05,
+                 max_rejections=5, refresh=4):
+        self.points = points
+        self.window = window
+        self.threshold = threshold
+        self.max_fraction = max_fraction
+        self.min_sweeps = max(min_sweeps, 1)
+        self.min_mad = min_mad
+        self.max_rejections = max_rejections
+        self.refresh = max(refresh, 1)
+        # one row per frequency, so the statistics run over contiguous memory
+        self._ring = np.empty((points, window), dtype=np.float64)
+        self._index = 0
+        self.filled = 0
+        self._stored = 0
+        self.median = None
+        self._limit = None
+        self.rejections = 0
+        self.rejected = 0
+        # fraction of deviating points of the last checked sweep
+        self.outlier_fraction = 0.0
+
+    def reset(self):
+        """Forgets all sweeps, e.g. after the sweep configuration changed."""
+        self._index = 0
+        self.filled = 0
+        self._stored = 0
+        self.median = None
+        self._limit = None
+        self.rejections = 0
+
+    def _store(self, sweep):
+        if self.median is not None:
+            sweep = np.where(np.isnan(sweep), self.median, sweep)
+        self._ring[:, self._index] = sweep
+        self._index = (self._index + 1) % self.window
+        self.filled = min(self.filled + 1, self.window)
+        self._stored += 1
+        if self.filled < self.min_sweeps or self._stored >= self.refresh:
+            self._update_statistics()
+
+    def _update_statistics(self):
+        recent = self._ring[:, :self.filled]
+        median = _row_median(recent)
+        mad = _row_median(np.abs(recent - median[:, None]))
+        self.median = median
+        self._limit = self.threshold * np.maximum(1.4826 * mad, self.min_mad)
+        self._stored = 0
+
+    def accept(self, sweep):
+        """
+        Checks a sweep and adds it to the window if it is no outlier.
+
+        Args:
+            sweep (np.ndarray): One sweep of `points` real values, NaN where missing.
+
+        Returns:
+            bool: False if the sweep was rejected.
+        """
+        sweep = np.asarray(sweep, dtype=np.float64)
+        if sweep.shape != (self.points,):
+            raise ValueError(f"Expected a sweep of {self.points} points, got shape {sweep.shape}.")
+        if self.filled < self.min_sweeps:
+            self.outlier_fraction = 0.0
+            self._store(sweep)
+            return True
+
+        with np.errstate(invalid="ignore"):
+            deviating = np.abs(sweep - self.median) > self._limit
+        self.outlier_fraction = np.count_nonzero(deviating) / self.points
+
+        if self.outlier_fraction > self.max_fraction:
+            self.rejected += 1
+            self.rejections += 1
+            if self.rejections < self.max_rejections:
+                return False
+            # the deviation lasts, start a new window from this sweep
+            median = self.median
+            self.reset()
+            self.median = median
+            self._store(sweep)
+            return True
+        self.rejections = 0
+        self._store(sweep)
+        return True
@@ -0,0 +1,164 @@
+import numpy as np
+
+from LiteVNA_S11 import frequency_grid
+from LiteVNAforPi_Moisture import LiteVNA, decode_sweep
+
+
+class OnePortCalibration:
+    """
+    Host-side one-port short/open/load (SOL) error correction.
+
+    The measured reflection M of a port with the actual reflection G is
+    modeled with three error terms per frequency:
+
+        M = e00 + e10e01 * G / (1 - e11 * G)
+
+    e00 is the directivity, e11 the source match and e10e01 the reflection
+    tracking. They are solved once from the sweeps of an ideal short (-1),
+    open (+1) and load (0); afterwards correct() inverts the model for whole
+    sweeps in one vectorized expression.
+
+    Sweeps of another configuration inside the calibrated range (e.g. the
+    zoomed windows of ZoomSweep) are corrected with error terms interpolated
+    to their frequencies, computed once per configuration and cached.
+
+    Args:
+        frequencies (np.ndarray): Calibrated frequencies in Hz, ascending.
+        directivity, source_match, tracking (np.ndarray): The complex error terms e00,
+            e11 and e10e01 at these frequencies.
+    """
+    cache_size = 64
+
+    def __init__(self, frequencies, directivity, source_match, tracking):
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.directivity = np.asarray(directivity, dtype=np.complex128)
+        self.source_match = np.asarray(source_match, dtype=np.complex128)
+        self.tracking = np.asarray(tracking, dtype=np.complex128)
+        if np.any(np.diff(self.frequencies) <= 0):
+            raise ValueError("Calibration frequencies must be ascending.")
+        self._configurations = {}
+
+    @classmethod
+    def from_standards(cls, frequencies, short_s11, open_s11, load_s11):
+        """
+        Solves the error terms from the measured S11 of the short, open and load standards.
+        """
+        short = np.asarray(short_s11, dtype=np.complex128)
+        open_ = np.asarray(open_s11, dtype=np.complex128)
+        load = np.asarray(load_s11, dtype=np.complex128)
+        directivity = load
+        source_match = (open_ + short - 2 * load) / (open_ - short)
+        tracking = (open_ - load) * (1 - source_match)
+        return cls(frequencies, directivity, source_match, tracking)
+
+    def save(self, filename):
+        """Stores the error terms in a NumPy .npz file."""
+        np.savez(filename, frequencies=self.frequencies, directivity=self.directivity,
+                 source_match=self.source_match, tracking=self.tracking)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads error terms stored with save()."""
+        with np.load(filename) as data:
+            return cls(data["frequencies"], data["directivity"], data["source_match"], data["tracking"])
+
+    def correct(self, s11):
+        """
+        Corrects one sweep or a batch of sweeps (one per row) measured at the calibrated frequencies.
+
+        Returns:
+            np.ndarray: The corrected complex S11, NaN stays NaN.
+        """
+        delta = np.asarray(s11) - self.directivity
+        with np.errstate(invalid="ignore"):
+            return delta / (self.tracking + self.source_match * delta)
+
+    def for_sweep(self, start_freq, step_freq, points):
+        """
+        Returns the calibration for the sweep configuration start_freq, step_freq, points.
+
+        The error terms are interpolated (real and imaginary part linearly) to
+        the sweep frequencies on the first call and cached for later sweeps.
+
+        Raises:
+            ValueError: If the sweep leaves the calibrated frequency range.
+        """
+        key = (start_freq, step_freq, points)
+        calibration = self._configurations.get(key)
+        if calibration is None:
+            frequencies = frequency_grid(start_freq, step_freq, points).hz
+            if np.array_equal(frequencies, self.frequencies):
+                calibration = self
+            else:
+                if frequencies[0] < self.frequencies[0] or frequencies[-1] > self.frequencies[-1]:
+                    raise ValueError(f"Sweep {frequencies[0]:.0f}..{frequencies[-1]:.0f} Hz is outside the "
+                                     f"calibrated range {self.frequencies[0]:.0f}..{self.frequencies[-1]:.0f} Hz.")
+                terms = [
+                    np.interp(frequencies, self.frequencies, term.real)
+                    + 1j * np.interp(frequencies, self.frequencies, term.imag)
+                    for term in (self.directivity, self.source_match, self.tracking)
+                ]
+                calibration = OnePortCalibration(frequencies, *terms)
+            if len(self._configurations) >= self.cache_size:
+                # forget the oldest configuration
+                del self._configurations[next(iter(self._configurations))]
+            self._configurations[key] = calibration
+        return calibration
+
+    def correct_sweep(self, s11, start_freq, step_freq, points):
+        """Corrects a sweep of any configuration inside the calibrated range, see for_sweep()."""
+        return self.for_sweep(start_freq, step_freq, points).correct(s11)
+
+
+def measure_standard(litevna, start_freq, step_freq, points, averages=2, sweeps=4):
+    """
+    Measures the raw S11 of a calibration standard, averaged over several sweeps.
+
+    Raises:
+        IOError: If a sweep is incomplete, a calibration needs every point.
+    """
+    litevna.configure_sweep(start_freq, step_freq, points, averages)
+    total = np.zeros(points, dtype=np.complex128)
+    for _ in range(sweeps):
+        litevna.clear_fifo(0x30)
+        fifo_data, missing = litevna.read_sweep(points)
+        if missing.any():
+            raise IOError(f"{int(missing.sum())} of {points} points missing while measuring a standard")
+        s11, s11_magnitude_db, s11_phase = decode_sweep(fifo_data)
+        total += s11
+    return total / sweeps
+
+
+def calibrate(litevna, start_freq, step_freq, points, averages=2, sweeps=4):
+    """
+    Guides through the measurement of the short, open and load standards.
+
+    Returns:
+        OnePortCalibration: The error terms of the sweep configuration.
+    """
+    standards = []
+    for name in ("SHORT", "OPEN", "LOAD"):
+        input(f"Connect the {name} standard and press Enter...")
+        standards.append(measure_standard(litevna, start_freq, step_freq, points, averages, sweeps))
+    frequencies = frequency_grid(start_freq, step_freq, points).hz
+    return OnePortCalibration.from_standards(frequencies, *standards)
+
+
+def main():
+    #port = "/dev/ttyUSB0"  # Replace with actual LiteVNA port
+    port = "COM3"
+    start_freq = 1200000000  # 1.2 GHz
+    stop_freq = 2000000000   # 2 GHz
+    points = 201
+    step_freq = (stop_freq - start_freq) // (points - 1)
+    litevna = LiteVNA(port)
+    try:
+        calibration = calibrate(litevna, start_freq, step_freq, points)
+    finally:
+        litevna.close()
+    calibration.save("sol_calibration.npz")
+    print("Calibration saved to sol_calibration.npz")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import struct
+import sys
+from array import array
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Precomputed frequency -> moisture table, built on the first lookup and rebuilt when it is
+# older than LiteVNAforPi_Moisture.py (where calibration_data lives); `python LiteVNA_MoistureLUT.py`
+# builds it ahead of time
+LUT_FILENAME = os.path.join(_DIRECTORY, "moisture_lut.bin")
+CALIBRATION_SOURCE = os.path.join(_DIRECTORY, "LiteVNAforPi_Moisture.py")
+
+# magic, start frequency (Hz), step (Hz), number of entries, moisture units per %
+_HEADER = struct.Struct("<4sQQIH")
+_MAGIC = b"MLUT"
+
+
+class MoistureLUT:
+    """
+    Frequency -> moisture lookup table at a fixed frequency resolution.
+
+    The moisture of every step_hz from start_hz on is stored as an unsigned
+    16-bit integer in 1/scale %. A lookup rounds the frequency to the nearest
+    entry and reads it, pure integer arithmetic without NumPy. Frequencies
+    outside the table get the moisture of the nearest end.
+
+    Args:
+        start_hz, step_hz (int): Frequency of the first entry and between the entries.
+        values (array): array("H") of moistures in 1/scale %.
+        scale (int): Moisture units per %.
+    """
+    def __init__(self, start_hz, step_hz, values, scale=100):
+        if step_hz <= 0 or not values:
+            raise ValueError("A moisture table needs a positive step and at least one entry.")
+        self.start_hz = start_hz
+        self.step_hz = step_hz
+        self.values = values
+        self.scale = scale
+        self._last = len(values) - 1
+
+    @property
+    def stop_hz(self):
+        return self.start_hz + self._last * self.step_hz
+
+    def moisture(self, frequency_hz):
+        """Moisture in % at frequency_hz (Hz), rounded to the table resolution."""
+        index = (int(frequency_hz) - self.start_hz + self.step_hz // 2) // self.step_hz
+        if index < 0:
+            index = 0
+        elif index > self._last:
+            index = self._last
+        return self.values[index] / self.scale
+
+    def save(self, filename=LUT_FILENAME):
+        values = array("H", self.values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        with open(filename, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, self.start_hz, self.step_hz, len(values), self.scale))
+            values.tofile(file)
+
+    @classmethod
+    def load(cls, filename=LUT_FILENAME):
+        """
+        Raises:
+            ValueError: If the file is no moisture table or is truncated.
+        """
+        with open(filename, "rb") as file:
+            header = file.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError(f"{filename} is not a moisture table")
+            magic, start_hz, step_hz, count, scale = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ValueError(f"{filename} is not a moisture table")
+            values = array("H")
+            try:
+                values.fromfile(file, count)
+            except EOFError:
+                raise ValueError(f"{filename} is truncated") from None
+        if sys.byteorder == "big":
+            values.byteswap()
+        return cls(start_hz, step_hz, values, scale)
+
+
+def build_lut(calibration_data=None, start_hz=1200000000, stop_hz=2000000000, step_hz=100000, scale=100):
+    """
+    Evaluates the calibration curve (MoistureCalibration) at every step_hz from start_hz to stop_hz.
+
+    Only building needs NumPy and LiteVNAforPi_Moisture, they are imported here.
+
+    calibration_data: rows of [frequency (GHz), amplitude (dB), moisture (%)], default
+    calibration_data of LiteVNAforPi_Moisture
+    """
+    import numpy as np
+    import LiteVNAforPi_Moisture
+
+    if calibration_data is None:
+        calibration_data = LiteVNAforPi_Moisture.calibration_data
+    model = LiteVNAforPi_Moisture.MoistureCalibration(calibration_data)
+    count = (stop_hz - start_hz) // step_hz + 1
+    frequencies = start_hz + step_hz * np.arange(count, dtype=np.int64)
+    moisture = model.moisture(frequencies / 1e9)
+    values = np.clip(np.round(moisture * scale), 0, 0xFFFF).astype(np.uint16)
+    return MoistureLUT(start_hz, step_hz, array("H", values.tolist()), scale)
+
+
+def _outdated(filename):
+    try:
+        built = os.stat(filename).st_mtime_ns
+    except OSError:
+        return True
+    try:
+        return built < os.stat(CALIBRATION_SOURCE).st_mtime_ns
+    except OSError:
+        # deployed without the calibration source, the table is all there is
+        return False
+
+
+def load_lut(filename=LUT_FILENAME):
+    """
+    Loads the table from filename, rebuilding and saving it first if it is missing,
+    unreadable or older than CALIBRATION_SOURCE.
+
+    Only two os.stat calls are needed while the table is up to date; NumPy is
+    imported only when the table has to be rebuilt.
+    """
+    if not _outdated(filename):
+        try:
+            return MoistureLUT.load(filename)
+        except (OSError, ValueError) as error:
+            print(f"Rebuilding the moisture table: {error}")
+    lut = build_lut()
+    try:
+        lut.save(filename)
+    except OSError as error:
+        print(f"Moisture table not saved: {error}")
+    return lut
+
+
+_lut = None
+
+
+def moisture(frequency_hz):
+    """
+    Moisture in % at frequency_hz (Hz) from the table in LUT_FILENAME, loaded on the first call.
+    """
+    global _lut
+    if _lut is None:
+        _lut = load_lut()
+    return _lut.moisture(frequency_hz)
+
+
+def main():
+    lut = build_lut()
+    lut.save()
+    print(f"Moisture table {lut.start_hz / 1e9}..{lut.stop_hz / 1e9} GHz in {lut.step_hz / 1e3:g} kHz steps "
+          f"saved to {LUT_FILENAME}")
+
+
+if __name__ == "__main__":
+    main()
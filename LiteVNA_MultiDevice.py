@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+import paho.mqtt.client as mqtt
+import serial
+
+from LiteVNA_Async import AsyncLiteVNA
+from LiteVNA_Averaging import OutlierRejector
+from LiteVNAforPi_Moisture import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, CalibrationRegistry, decode_sweep,
+                                   evaluate_sweep)
+
+
+class DeviceStats:
+    """Sweep and error counters of one device."""
+    def __init__(self):
+        self.sweeps = 0
+        self.errors = 0
+        # sweeps dropped by the outlier rejection
+        self.rejected = 0
+        self.last_error = None
+        self.started = time.monotonic()
+
+    @property
+    def sweep_rate(self):
+        """Completed sweeps per second since the orchestrator started."""
+        elapsed = time.monotonic() - self.started
+        return self.sweeps / elapsed if elapsed > 0 else 0.0
+
+
+class AcquisitionOrchestrator:
+    """
+    Drives several LiteVNA devices from one process.
+
+    Every device gets its own I/O worker (an AsyncLiteVNA with its own
+    thread) that connects to it and only transfers raw sweeps. A device that
+    cannot be reached is retried with a growing delay (min_backoff doubling
+    up to max_backoff) and counted in its errors, without holding up the others. Decoding, the moisture calculation
+    and publishing are shared: one processing stage consumes the sweeps of all
+    devices, drops sweeps that deviate from the device's recent ones
+    (OutlierRejector) and publishes the rest over a single MQTT connection to
+    `<topic>/<device name>`. The moisture of every device is calculated with
+    its own calibration table, looked up by device name in a CalibrationRegistry.
+    """
+    def __init__(self, devices, start_freq, step_freq, points, averages=2, topic=MQTT_TOPIC, report_interval=30,
+                 calibrations=None, min_backoff=1, max_backoff=60):
+        """
+        Args:
+            devices (dict): Device name -> serial port (or AsyncLiteVNA).
+            report_interval (float): Seconds between the printed statistics, 0 disables them.
+            calibrations (CalibrationRegistry): Calibration tables by device name, default
+                calibration/<device name>.csv next to LiteVNAforPi_Moisture.py.
+        """
+        self.vnas = {
+            name: port if isinstance(port, AsyncLiteVNA) else AsyncLiteVNA(port)
+            for name, port in devices.items()
+        }
+        self.start_freq = start_freq
+        self.step_freq = step_freq
+        self.points = points
+        self.averages = averages
+        self.topic = topic
+        self.report_interval = report_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stats = {name: DeviceStats() for name in self.vnas}
+        self.rejectors = {name: OutlierRejector(points) for name in self.vnas}
+        self.calibrations = CalibrationRegistry() if calibrations is None else calibrations
+        self._queue = asyncio.Queue(maxsize=2 * len(self.vnas))
+        self._client = None
+        self._next_connect = 0
+
+    async def _device_worker(self, name, vna):
+        stats = self.stats[name]
+        backoff = self.min_backoff
+        while True:
+            try:
+                # connects on the first sweep and again after a lost connection
+                fifo_data, missing = await vna.read_sweep(self.start_freq, self.step_freq, self.points, self.averages)
+            except serial.SerialException as error:
+                stats.errors += 1
+                stats.last_error = str(error)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            except IOError as error:
+                stats.errors += 1
+                stats.last_error = str(error)
+                continue
+            backoff = self.min_backoff
+            stats.sweeps += 1
+            await self._queue.put((name, fifo_data, missing))
+
+    async def _processing(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            name, fifo_data, missing = await self._queue.get()
+            try:
+                s11, s11_magnitude_db, s11_phase = decode_sweep(fifo_data, missing)
+                if not self.rejectors[name].accept(s11_magnitude_db):
+                    self.stats[name].rejected += 1
+                    continue
+                message = evaluate_sweep(s11_magnitude_db, self.start_freq, self.step_freq,
+                                         model=self.calibrations.get(name))
+            except Exception as error:
+                # a bad sweep of one device must not stop the others
+                self.stats[name].errors += 1
+                self.stats[name].last_error = str(error)
+                continue
+            print(f"{name}: {message}")
+            await loop.run_in_executor(None, self._publish, name, message)
+
+    def _connect_mqtt(self):
+        # do not hold up the processing stage with a connection attempt on every sweep
+        if time.monotonic() < self._next_connect:
+            return
+        self._next_connect = time.monotonic() + 60
+        try:
+            client = mqtt.Client()
+            client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            # the network loop thread keeps the connection alive and reconnects
+            client.loop_start()
+            self._client = client
+        except Exception:
+            print("No MQTT connection")
+
+    def _publish(self, name, message):
+        if self._client is None:
+            self._connect_mqtt()
+        if self._client is not None:
+            self._client.publish(f"{self.topic}/{name}", message)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(self.report())
+
+    def report(self):
+        """Formats sweep rate and error count of every device."""
+        lines = []
+        for name, stats in self.stats.items():
+            line = f"{name}: {stats.sweep_rate:.2f} sweeps/s, {stats.sweeps} sweeps, {stats.rejected} rejected, {stats.errors} errors"
+            if stats.last_error:
+                line += f" (last: {stats.last_error})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    async def run(self):
+        for stats in self.stats.values():
+            stats.started = time.monotonic()
+        tasks = [asyncio.create_task(self._device_worker(name, vna)) for name, vna in self.vnas.items()]
+        tasks.append(asyncio.create_task(self._processing()))
+        if self.report_interval:
+            tasks.append(asyncio.create_task(self._report()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for vna in self.vnas.values():
+                await vna.close()
+            if self._client is not None:
+                self._client.loop_stop()
+                self._client.disconnect()
+
+
+def main():
+    # Device name (used in the MQTT topic) -> serial port of its LiteVNA
+    devices = {
+        "probe1": "/dev/ttyUSB0",
+        "probe2": "/dev/ttyUSB1",
+    }
+    start_freq = 1200000000  # 1.2 GHz
+    stop_freq = 2000000000   # 2 GHz
+    points = 201
+    step_freq = (stop_freq - start_freq) // (points - 1)
+    averages = 2
+    orchestrator = AcquisitionOrchestrator(devices, start_freq, step_freq, points, averages)
+    try:
+        asyncio.run(orchestrator.run())
+    except KeyboardInterrupt:
+        print("\nTerminating...")
+        print(orchestrator.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+import os
+import time
+import warnings
+
+import numpy as np
+
+from LiteVNA_Calibration import OnePortCalibration
+from LiteVNA_S11 import frequency_grid, s11_to_polar
+from LiteVNAforPi_Moisture import LiteVNASession, decode_sweep, format_measurement, publish_message
+
+
+def _fit_window(frequencies, s11_magnitude_db, half_width):
+    # points around the minimum, without gaps (NaN) and -inf of zero readings
+    i = int(np.nanargmin(s11_magnitude_db))
+    lo = max(i - half_width, 0)
+    hi = min(i + half_width + 1, len(s11_magnitude_db))
+    f = np.asarray(frequencies[lo:hi], dtype=np.float64)
+    y = np.asarray(s11_magnitude_db[lo:hi], dtype=np.float64)
+    valid = np.isfinite(y)
+    return i, f[valid], y[valid]
+
+
+def _r_squared(y, fitted):
+    ss_tot = np.sum((y - y.mean()) ** 2)
+    if ss_tot == 0:
+        return 0.0
+    return float(1 - np.sum((y - fitted) ** 2) / ss_tot)
+
+
+def _vertex_goodness(frequencies, s11_magnitude_db, half_width, vertex_freq, scale):
+    # R^2 in power of a(x - vertex)^2 + c fitted to the wider window around the minimum
+    i, f, y = _fit_window(frequencies, s11_magnitude_db, half_width)
+    x = (f - vertex_freq) / scale
+    power = 10 ** (y / 10)
+    design = np.column_stack([x ** 2, np.ones_like(x)])
+    coefficients = np.linalg.lstsq(design, power, rcond=None)[0]
+    return max(_r_squared(power, design @ coefficients), 0.0)
+
+
+def fit_parabola(frequencies, s11_magnitude_db, half_width=1, goodness_width=3):
+    """
+    Interpolates the resonance between the sweep points with a parabola.
+
+    A least-squares parabola is fitted to the reflected power (linear, not dB)
+    of the 2 * half_width + 1 points around the minimum; its vertex is the
+    resonance. Near the minimum a dip is close to a parabola in power, but not
+    in dB, and the wider the window the more the flanks pull the vertex up:
+    the default fits the minimum and its two neighbours exactly.
+
+    An exact fit says nothing about the estimate, so the goodness is taken over
+    the 2 * goodness_width + 1 points around the minimum instead: the R^2 in
+    power of a parabola held at the vertex, with only curvature and offset free.
+    Noise that shifted the vertex away from the dip lowers it.
+
+    Returns:
+        tuple: (frequency in Hz, depth in dB, goodness between 0 and 1). The depth is
+        never above the measured minimum. If the points do not form a dip, the raw
+        minimum is returned with a goodness of 0.
+    """
+    i, f, y = _fit_window(frequencies, s11_magnitude_db, half_width)
+    minimum = float(s11_magnitude_db[i])
+    if len(f) < 3:
+        return float(frequencies[i]), minimum, 0.0
+    # fit in units of sweep steps around the minimum to keep the system well conditioned
+    scale = (f[-1] - f[0]) / (len(f) - 1)
+    x = (f - frequencies[i]) / scale
+    power = 10 ** (y / 10)
+    a, b, c = np.polyfit(x, power, 2)
+    if a <= 0:
+        return float(frequencies[i]), minimum, 0.0
+    vertex = np.clip(-b / (2 * a), x[0], x[-1])
+    vertex_power = a * vertex ** 2 + b * vertex + c
+    depth = 10 * np.log10(vertex_power) if vertex_power > 0 else minimum
+    goodness = _vertex_goodness(frequencies, s11_magnitude_db, max(goodness_width, half_width),
+                                frequencies[i] + vertex * scale, scale)
+    return float(frequencies[i] + vertex * scale), float(min(depth, minimum)), goodness
+
+
+def fit_lorentzian(frequencies, s11_magnitude_db, half_width=10, iterations=30):
+    """
+    Fits a Lorentzian dip to the reflected power around the minimum.
+
+    The model |S11|^2 = B - A / (1 + ((f - f0) / g)^2) is fitted with
+    Levenberg-Marquardt, starting from the parabolic estimate. It also uses
+    the shoulders of the dip and holds up better with few sweep points.
+
+    Returns:
+        tuple: (frequency in Hz, depth in dB, R^2 of the fit in linear power).
+        Falls back to fit_parabola if the fit does not converge to a dip.
+    """
+    parabola = fit_parabola(frequencies, s11_magnitude_db)
+    i, f, y = _fit_window(frequencies, s11_magnitude_db, half_width)
+    if len(f) < 5:
+        return parabola
+    scale = (f[-1] - f[0]) / (len(f) - 1)
+    x = (f - frequencies[i]) / scale
+    power = 10 ** (y / 10)
+
+    def model(params):
+        base, amplitude, center, width = params
+        u = (x - center) / width
+        d = 1 + u ** 2
+        value = base - amplitude / d
+        jacobian = np.column_stack([
+            np.ones_like(x),
+            -1 / d,
+            -amplitude * 2 * u / (width * d ** 2),
+            -amplitude * 2 * u ** 2 / (width * d ** 2),
+        ])
+        return value, jacobian
+
+    base = power.max()
+    # starting width: half the number of points below the half-depth level
+    width = max(np.count_nonzero(power < (base + power.min()) / 2) / 2, 0.5)
+    params = np.array([base, base - power.min(), (parabola[0] - frequencies[i]) / scale, width])
+    damping = 1e-3
+    value, jacobian = model(params)
+    error = np.sum((power - value) ** 2)
+    for _ in range(iterations):
+        jtj = jacobian.T @ jacobian
+        step = np.linalg.solve(jtj + damping * np.diag(np.diag(jtj) + 1e-12), jacobian.T @ (power - value))
+        candidate = params + step
+        candidate[3] = abs(candidate[3])
+        candidate_value, candidate_jacobian = model(candidate)
+        candidate_error = np.sum((power - candidate_value) ** 2)
+        if candidate_error < error:
+            params, value, jacobian, error = candidate, candidate_value, candidate_jacobian, candidate_error
+            damping /= 10
+        else:
+            damping *= 10
+
+    base, amplitude, center, width = params
+    minimum = base - amplitude
+    if amplitude <= 0 or minimum <= 0 or not x[0] <= center <= x[-1]:
+        return parabola
+    return float(frequencies[i] + center * scale), float(10 * np.log10(minimum)), _r_squared(power, value)
+
+
+def estimate_resonance(frequencies, s11_magnitude_db, method="parabolic"):
+    """
+    Estimates the resonance of one sweep with sub-step resolution.
+
+    Args:
+        frequencies (np.ndarray): Frequency of every sweep point in Hz.
+        s11_magnitude_db (np.ndarray): S11 magnitude in dB, NaN for gaps.
+        method (str): "parabolic" or "lorentzian".
+
+    Returns:
+        tuple: (frequency in Hz, depth in dB, R^2 goodness of fit).
+    """
+    if method == "parabolic":
+        return fit_parabola(frequencies, s11_magnitude_db)
+    elif method == "lorentzian":
+        return fit_lorentzian(frequencies, s11_magnitude_db)
+    else:
+        raise ValueError(f"Unknown resonance estimation method: {method}")
+
+
+# Features of one sweep as returned by resonance_features
+RESONANCE_FEATURES_DTYPE = np.dtype([
+    ("frequency", "<f8"),   # Hz, interpolated between the points
+    ("amplitude", "<f8"),   # dB at the interpolated minimum
+    ("depth", "<f8"),       # dB below the baseline (median of the sweep)
+    ("bandwidth", "<f8"),   # Hz, -3 dB bandwidth of the dip
+    ("q", "<f8"),           # loaded Q, frequency / bandwidth
+    ("area", "<f8"),        # dB * Hz between the dip and the baseline
+    ("centroid", "<f8"),    # Hz, centre of that area
+])
+
+
+def resonance_features(frequencies, s11_magnitude_db):
+    """
+    Extracts the features of the resonance dip of one sweep or many sweeps at once.
+
+    All sweeps are processed together without a Python loop over them, e.g.
+    an (N, points) array of archived sweeps. The baseline is the median of a
+    sweep. The -3 dB bandwidth is the width of the dip at half the power drop
+    between the baseline and the minimum (3 dB below the baseline for a deep
+    dip), linearly interpolated between the points; it is NaN if the dip is
+    not inside the sweep on both sides. Sweeps without any value get NaN
+    features.
+
+    Args:
+        frequencies (np.ndarray): Frequency of every sweep point in Hz, ascending.
+        s11_magnitude_db (np.ndarray): S11 magnitude in dB with the points in the
+            last axis, NaN for gaps.
+
+    Returns:
+        np.ndarray: RESONANCE_FEATURES_DTYPE records with the shape of the leading axes
+        (0-d for a single sweep).
+    """
+    f = np.asarray(frequencies, dtype=np.float64)
+    db = np.asarray(s11_magnitude_db, dtype=np.float64)
+    shape = db.shape[:-1]
+    db = db.reshape(-1, db.shape[-1])
+    count, points = db.shape
+    rows = np.arange(count)
+    index = np.arange(points)
+
+    # gaps and -inf of zero readings do not take part in the minimum
+    finite = np.where(np.isfinite(db), db, np.nan)
+    empty = np.isnan(finite).all(axis=1)
+    i = np.argmin(np.where(np.isnan(finite), np.inf, finite), axis=1)
+    amplitude = finite[rows, i]
+    with warnings.catch_warnings():
+        # sweeps without any value get NaN features
+        warnings.simplefilter("ignore", RuntimeWarning)
+        baseline = np.nanmedian(finite, axis=1)
+
+    # sub-step minimum from the parabola through the minimum and its neighbours, in linear
+    # power where a Lorentzian dip is close to a parabola
+    power = 10 ** (finite / 10)
+    minimum = power[rows, i]
+    left = power[rows, np.maximum(i - 1, 0)]
+    right = power[rows, np.minimum(i + 1, points - 1)]
+    curvature = left - 2 * minimum + right
+    inner = (i > 0) & (i < points - 1) & (curvature > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        offset = np.where(inner, 0.5 * (left - right) / curvature, 0.0)
+        vertex = minimum - 0.25 * (left - right) * offset
+        amplitude = np.where(inner & (vertex > 0), 10 * np.log10(vertex), amplitude)
+    neighbour = np.clip(i + np.where(offset < 0, -1, 1), 0, points - 1)
+    frequency = f[i] + offset * np.abs(f[neighbour] - f[i])
+
+    # bandwidth: nearest crossings of the half-power level on both sides of the minimum
+    level = (10 ** (baseline / 10) + minimum) / 2
+    above = ~(power < level[:, None])
+    lo = np.where(above & (index <= i[:, None]), index, -1).max(axis=1)
+    hi = np.where(above & (index >= i[:, None]), index, points).min(axis=1)
+    inside = (lo >= 0) & (hi < points)
+    lo, hi = np.clip(lo, 0, points - 2), np.clip(hi, 1, points - 1)
+
+    def crossing(a, b):
+        pa, pb = power[rows, a], power[rows, b]
+        return f[a] + (level - pa) / (pb - pa) * (f[b] - f[a])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bandwidth = np.where(inside, crossing(hi - 1, hi) - crossing(lo, lo + 1), np.nan)
+        q = frequency / bandwidth
+
+    # area and centroid of the dip below the baseline, trapezoidal rule
+    dip = np.nan_to_num(np.clip(baseline[:, None] - finite, 0, None))
+    widths = np.diff(f)
+    area = np.sum((dip[:, 1:] + dip[:, :-1]) / 2 * widths, axis=1)
+    moment = np.sum((dip[:, 1:] * f[1:] + dip[:, :-1] * f[:-1]) / 2 * widths, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = moment / area
+
+    features = np.empty(count, dtype=RESONANCE_FEATURES_DTYPE)
+    features["frequency"] = frequency
+    features["amplitude"] = amplitude
+    features["depth"] = baseline - amplitude
+    features["bandwidth"] = bandwidth
+    features["q"] = q
+    features["area"] = area
+    features["centroid"] = centroid
+    for name in features.dtype.names:
+        features[name][empty] = np.nan
+    return features.reshape(shape)
+
+
+class ResonanceTracker:
+    """
+    Kalman filter that carries the resonance from one sweep to the next.
+
+    The frequency is tracked with a constant-drift model (frequency and drift
+    in Hz/s), the depth as a random walk. Measurements with a poor fit
+    (low goodness) are trusted less. A measurement further than gate standard
+    deviations from the prediction is ignored, unless max_rejections of them
+    follow each other; then the resonance really moved and the filter restarts.
+
+    Noise parameters are standard deviations: frequency_noise (Hz) and
+    depth_noise (dB) of a single estimate, drift_noise (Hz/s per sqrt(s)) and
+    depth_drift (dB per sqrt(s)) of the changes between sweeps.
+    """
+    def __init__(self, frequency_noise=1000000, drift_noise=20000, depth_noise=0.5, depth_drift=0.05,
+                 gate=5, max_rejections=3):
+        self.frequency_noise = frequency_noise
+        self.drift_noise = drift_noise
+        self.depth_noise = depth_noise
+        self.depth_drift = depth_drift
+        self.gate = gate
+        self.max_rejections = max_rejections
+        self.reset()
+
+    def reset(self):
+        self.state = None       # [frequency, drift]
+        self.covariance = None
+        self.depth = None
+        self.depth_variance = None
+        self.time = None
+        self.rejections = 0
+
+    @property
+    def initialized(self):
+        return self.state is not None
+
+    def _predict(self, timestamp):
+        dt = max(timestamp - self.time, 0.0)
+        transition = np.array([[1.0, dt], [0.0, 1.0]])
+        q = self.drift_noise ** 2
+        process = q * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        state = transition @ self.state
+        covariance = transition @ self.covariance @ transition.T + process
+        depth_variance = self.depth_variance + self.depth_drift ** 2 * dt
+        return state, covariance, depth_variance
+
+    def predict(self, timestamp=None):
+        """
+        Returns:
+            tuple: (frequency in Hz, its standard deviation) expected at timestamp.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        state, covariance, depth_variance = self._predict(timestamp)
+        return float(state[0]), float(np.sqrt(covariance[0, 0]))
+
+    def predicted_window(self, timestamp=None, sigmas=4):
+        """
+        Returns:
+            tuple: (low, high) frequency in Hz within which the next resonance is expected.
+        """
+        frequency, deviation = self.predict(timestamp)
+        # the window also has to hold a single noisy estimate
+        half_width = sigmas * np.hypot(deviation, self.frequency_noise)
+        return frequency - half_width, frequency + half_width
+
+    def update(self, frequency, depth, goodness=1.0, timestamp=None):
+        """
+        Adds the resonance estimated from one sweep.
+
+        Returns:
+            tuple: filtered (frequency in Hz, depth in dB).
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        # a poor fit counts as a noisier measurement
+        trust = max(goodness, 0.05)
+        frequency_variance = self.frequency_noise ** 2 / trust
+        depth_variance = self.depth_noise ** 2 / trust
+        if self.state is None:
+            self.state = np.array([frequency, 0.0])
+            self.covariance = np.diag([frequency_variance, self.drift_noise ** 2])
+            self.depth = depth
+            self.depth_variance = depth_variance
+            self.time = timestamp
+            return frequency, depth
+
+        state, covariance, predicted_depth_variance = self._predict(timestamp)
+        innovation = frequency - state[0]
+        innovation_variance = covariance[0, 0] + frequency_variance
+        if self.gate and innovation ** 2 > self.gate ** 2 * innovation_variance:
+            self.rejections += 1
+            if self.rejections < self.max_rejections:
+                return float(self.state[0]), float(self.depth)
+            self.reset()
+            return self.update(frequency, depth, goodness, timestamp)
+        self.rejections = 0
+
+        gain = covariance[:, 0] / innovation_variance
+        self.state = state + gain * innovation
+        self.covariance = covariance - np.outer(gain, covariance[0, :])
+        depth_gain = predicted_depth_variance / (predicted_depth_variance + depth_variance)
+        self.depth = self.depth + depth_gain * (depth - self.depth)
+        self.depth_variance = (1 - depth_gain) * predicted_depth_variance
+        self.time = timestamp
+        return float(self.state[0]), float(self.depth)
+
+
+class ZoomSweep:
+    """
+    Adaptive coarse-to-fine sweep that follows one resonance.
+
+    A coarse sweep over the full range with few points locates the dip. The
+    sweep is then retuned to a narrow window of zoom_span Hz around it, and
+    later sweeps only measure that window, re-centered on the dip every time.
+    When the dip moves into the outer edge_margin points of the window, is
+    less than min_dip_db below the median of the window (the resonance left
+    it) or the sweep is empty, the next sweep starts over with the coarse pass.
+    Thanks to the register shadow of LiteVNA, re-centering only rewrites the
+    start frequency.
+
+    With a ResonanceTracker, every zoomed sweep is estimated with method and
+    fed to the tracker, and the window follows its prediction: it is narrowed
+    down to the tracker's predicted window, but not below min_zoom_span.
+
+    With a OnePortCalibration (LiteVNA_Calibration) covering start_freq..stop_freq,
+    every sweep is error corrected; the error terms of each window are
+    interpolated once and cached by the calibration.
+    """
+    def __init__(self, session, start_freq, stop_freq, coarse_points=41, zoom_span=80000000, zoom_points=41,
+                 averages=2, edge_margin=2, min_dip_db=3, tracker=None, min_zoom_span=20000000,
+                 method="parabolic", calibration=None):
+        self.session = session
+        self.start_freq = start_freq
+        self.stop_freq = stop_freq
+        self.coarse_points = coarse_points
+        self.zoom_span = zoom_span
+        self.zoom_points = zoom_points
+        self.averages = averages
+        self.edge_margin = edge_margin
+        self.min_dip_db = min_dip_db
+        self.tracker = tracker
+        self.min_zoom_span = min_zoom_span
+        self.method = method
+        self.calibration = calibration
+        # frequency of the dip in the last sweep, None before the coarse pass
+        self.center = None
+        # (frequency, depth) of the last zoomed sweep, filtered if there is a tracker
+        self.resonance = None
+
+    def window(self):
+        """
+        Returns the (start_freq, step_freq, points) of the next sweep.
+        """
+        if self.center is None:
+            step_freq = (self.stop_freq - self.start_freq) // (self.coarse_points - 1)
+            return self.start_freq, step_freq, self.coarse_points
+        center = self.center
+        span = self.zoom_span
+        if self.tracker is not None and self.tracker.initialized:
+            low, high = self.tracker.predicted_window()
+            center = (low + high) / 2
+            span = min(max(high - low, self.min_zoom_span), self.zoom_span)
+        step_freq = int(span) // (self.zoom_points - 1)
+        span = step_freq * (self.zoom_points - 1)
+        start_freq = int(center) - span // 2
+        # keep the window inside the full range
+        start_freq = max(self.start_freq, min(start_freq, self.stop_freq - span))
+        return start_freq, step_freq, self.zoom_points
+
+    def sweep(self):
+        """
+        Measures the next zoomed sweep, running the coarse pass first if needed.
+
+        Returns:
+            tuple: (start_freq, step_freq, s11, s11_magnitude_db, s11_phase) of the
+            zoomed sweep, or None if the device delivered no valid values.
+        """
+        result = None
+        # losing the dip costs a coarse pass and a new zoom, the loop bounds the retries
+        for _ in range(4):
+            coarse = self.center is None
+            start_freq, step_freq, points = self.window()
+            fifo_data, missing = self.session.sweep(start_freq, step_freq, points, self.averages)
+            s11, s11_magnitude_db, s11_phase = decode_sweep(fifo_data, missing)
+            if self.calibration is not None:
+                s11 = self.calibration.correct_sweep(s11, start_freq, step_freq, points)
+                s11_magnitude, s11_magnitude_db, s11_phase = s11_to_polar(s11, unwrap=False)
+            if missing.all():
+                self._lose()
+                continue
+            i = int(np.nanargmin(s11_magnitude_db))
+            inside = self.edge_margin <= i < points - self.edge_margin
+            dip = np.nanmedian(s11_magnitude_db) - s11_magnitude_db[i] >= self.min_dip_db
+            if not coarse and not (inside and dip):
+                self._lose()
+                continue
+            self.center = start_freq + i * step_freq
+            if not coarse:
+                result = start_freq, step_freq, s11, s11_magnitude_db, s11_phase
+                self._estimate(start_freq, step_freq, s11_magnitude_db)
+                break
+        return result
+
+    def _lose(self):
+        # the prediction was wrong, start over with the coarse pass
+        self.center = None
+        if self.tracker is not None:
+            self.tracker.reset()
+
+    def _estimate(self, start_freq, step_freq, s11_magnitude_db):
+        frequencies = frequency_grid(start_freq, step_freq, len(s11_magnitude_db)).hz
+        frequency, depth, goodness = estimate_resonance(frequencies, s11_magnitude_db, self.method)
+        if self.tracker is not None:
+            frequency, depth = self.tracker.update(frequency, depth, goodness)
+        self.resonance = frequency, depth
+
+
+def main():
+    #port = "/dev/ttyUSB0"  # Replace with actual LiteVNA port
+    port = "COM3"
+    session = LiteVNASession(port)
+    start_freq = 1200000000  # 1.2 GHz
+    stop_freq = 2000000000   # 2 GHz
+    # 41 points over at most 80 MHz, the fit interpolates the dip between them and the
+    # tracker smooths the readings and narrows the window as long as the resonance is steady
+    # error terms stored by LiteVNA_Calibration.py for 1.2..2 GHz, if the probe was calibrated
+    calibration = None
+    if os.path.exists("sol_calibration.npz"):
+        calibration = OnePortCalibration.load("sol_calibration.npz")
+    zoom = ZoomSweep(session, start_freq, stop_freq, coarse_points=41, zoom_span=80000000, zoom_points=41,
+                     tracker=ResonanceTracker(), calibration=calibration)
+    try:
+        while True:
+            if zoom.sweep() is None:
+                print("Error: Resonance not found")
+                continue
+            message = format_measurement(*zoom.resonance)
+            print(message)
+            publish_message(message)
+            time.sleep(2)
+    except KeyboardInterrupt:
+        print("\nTerminating...")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
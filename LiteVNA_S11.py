@@ -0,0 +1,122 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Layout of one 32-byte record of the values FIFO (0x30) according to the LiteVNA user guide
+FIFO_RECORD_DTYPE = np.dtype([
+    ("fwd0Re", "<i4"),
+    ("fwd0Im", "<i4"),
+    ("rev0Re", "<i4"),
+    ("rev0Im", "<i4"),
+    ("rev1Re", "<i4"),
+    ("rev1Im", "<i4"),
+    ("freqIndex", "<u2"),
+    ("reserved", "V6"),
+])
+FIFO_RECORD_SIZE = FIFO_RECORD_DTYPE.itemsize
+
+
+class FrequencyGrid:
+    """
+    Frequency axis of one sweep configuration.
+
+    The points are start_freq + i * step_freq with the integer step the
+    device is programmed with, unlike np.linspace(start_freq, stop_freq, points),
+    which spreads the rounding of step_freq over the sweep. Get grids with
+    frequency_grid() so every configuration is only computed once; the arrays
+    are read-only because they are shared.
+
+    Attributes:
+        hz (np.ndarray): Frequencies in Hz.
+        ghz (np.ndarray): Frequencies in GHz.
+    """
+    def __init__(self, start_freq, step_freq, points):
+        self.start_freq = start_freq
+        self.step_freq = step_freq
+        self.points = points
+        self.stop_freq = start_freq + step_freq * (points - 1)
+        self.hz = start_freq + step_freq * np.arange(points, dtype=np.float64)
+        self.ghz = self.hz / 1e9
+        for axis in (self.hz, self.ghz):
+            axis.flags.writeable = False
+
+    def __len__(self):
+        return self.points
+
+    def frequency(self, index):
+        """Frequency in Hz of a (possibly fractional) point index, e.g. of np.nanargmin."""
+        return self.start_freq + index * self.step_freq
+
+
+@lru_cache(maxsize=64)
+def frequency_grid(start_freq, step_freq, points):
+    """
+    Returns the FrequencyGrid of a sweep configuration, created only once.
+    """
+    return FrequencyGrid(start_freq, step_freq, points)
+
+
+def parse_fifo_records(raw_response):
+    """
+    Views a buffer of FIFO blocks as a structured array without copying.
+
+    This is the array counterpart of parse_fifo_block in the scripts: every
+    element has the fields fwd0Re, fwd0Im, rev0Re, rev0Im, rev1Re, rev1Im and
+    freqIndex. A trailing incomplete block is ignored.
+
+    Args:
+        raw_response (bytes): Consecutive 32-byte blocks from the valuesFIFO.
+
+    Returns:
+        np.ndarray: One record per block.
+    """
+    return np.frombuffer(raw_response, dtype=FIFO_RECORD_DTYPE, count=len(raw_response) // FIFO_RECORD_SIZE)
+
+
+def s11_from_fifo(raw_response, dtype=np.complex64, unwrap=True):
+    """
+    Computes S11 = rev0 / fwd0 for all blocks of a FIFO read in one call.
+
+    Blocks with fwd0 == 0 (and |S11| below 1e-9) carry no measurement: their
+    S11 and magnitude are 0, the magnitude in dB is -inf (matplotlib leaves
+    these points out) and the phase is 0. Nothing raises ZeroDivisionError.
+
+    Args:
+        raw_response (bytes): Consecutive 32-byte blocks from the valuesFIFO.
+        dtype: Complex type of the result.
+        unwrap (bool): Remove the 2 pi jumps of the phase along the sweep.
+
+    Returns:
+        tuple: (s11, magnitude, magnitude_db, phase) as NumPy arrays, the phase in radians.
+    """
+    records = parse_fifo_records(raw_response)
+    fwd0 = np.empty(len(records), dtype=dtype)
+    fwd0.real = records["fwd0Re"]
+    fwd0.imag = records["fwd0Im"]
+    rev0 = np.empty(len(records), dtype=dtype)
+    rev0.real = records["rev0Re"]
+    rev0.imag = records["rev0Im"]
+
+    s11 = np.zeros(len(records), dtype=dtype)
+    np.divide(rev0, fwd0, out=s11, where=np.abs(fwd0) > 1e-9)
+    return (s11,) + s11_to_polar(s11, unwrap)
+
+
+def s11_to_polar(s11, unwrap=True):
+    """
+    Converts complex S11 values to magnitude, magnitude in dB and phase.
+
+    Magnitudes below 1e-9 are reported as -inf dB, like in s11_from_fifo.
+    NaN values (missing points) stay NaN.
+
+    Returns:
+        tuple: (magnitude, magnitude_db, phase) as NumPy arrays, the phase in radians.
+    """
+    magnitude = np.abs(s11)
+    valid = magnitude > 1e-9
+    magnitude_db = np.where(np.isnan(magnitude), np.nan, -np.inf).astype(magnitude.dtype)
+    magnitude_db[valid] = 20 * np.log10(magnitude[valid])
+    phase = np.angle(s11)
+    if unwrap:
+        phase = np.unwrap(phase)
+    return magnitude, magnitude_db, phase
@@ -0,0 +1,320 @@
+import ast
+import os
+import threading
+import time
+
+import numpy as np
+
+from LiteVNA_S11 import FIFO_RECORD_DTYPE, frequency_grid
+from LiteVNAforPi_Moisture import LiteVNA
+
+# Register map of the LiteVNA user guide that the simulator evaluates
+REG_SWEEP_START = 0x00
+REG_SWEEP_STEP = 0x10
+REG_SWEEP_POINTS = 0x20
+REG_VALUES_PER_FREQUENCY = 0x22
+REG_VALUES_FIFO = 0x30
+REG_AVERAGE = 0x40
+REG_DEVICE_VARIANT = 0xF0
+REG_PROTOCOL_VERSION = 0xF1
+
+# Opcode -> number of argument bytes following the opcode
+COMMAND_LENGTHS = {
+    0x00: 0,  # NOP
+    0x0D: 0,  # INDICATE
+    0x10: 1,  # READ (1 byte register)
+    0x11: 1,  # READ2
+    0x12: 1,  # READ4
+    0x18: 2,  # READFIFO address, count
+    0x20: 2,  # WRITE address, 1 byte value
+    0x21: 3,  # WRITE2
+    0x22: 5,  # WRITE4
+    0x23: 9,  # WRITE8
+}
+
+# Amplitude of the simulated forward wave in raw ADC units
+FWD0_AMPLITUDE = 1 << 20
+
+
+def load_curve(filename):
+    """
+    Loads a recorded S11 magnitude curve for replay.
+
+    Supports the Python files with embedded measurements (a `data` list of
+    (GHz, dB) tuples as in LiteVNA_TEstData.py or an `input_data` string as in
+    output_convert.py) and plain two-column text files as read by plot_Data.py.
+    The files are parsed, not imported, so their plotting code is not run.
+
+    Args:
+        filename (str): Path of the file holding the curve.
+
+    Returns:
+        tuple: (frequencies in Hz, magnitudes in dB) as NumPy arrays sorted by frequency.
+    """
+    if filename.endswith(".py"):
+        with open(filename) as file:
+            tree = ast.parse(file.read())
+        pairs = None
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)):
+                continue
+            if node.targets[0].id == "data":
+                pairs = ast.literal_eval(node.value)
+            elif node.targets[0].id == "input_data":
+                lines = ast.literal_eval(node.value).strip().split("\n")
+                pairs = [(float(line.split()[0]), float(line.split()[1])) for line in lines]
+            if pairs is not None:
+                break
+        if pairs is None:
+            raise ValueError(f"No measurement data found in {filename}")
+        curve = np.array(pairs, dtype=float)
+    else:
+        curve = np.loadtxt(filename)
+    curve = curve[np.argsort(curve[:, 0])]
+    return curve[:, 0] * 1e9, curve[:, 1]
+
+
+class SimulatedLiteVNA:
+    """
+    Stands in for a LiteVNA connected through serial.Serial.
+
+    It understands the binary protocol used by the scripts: register writes
+    (0x20-0x23), register reads (0x10-0x12), INDICATE (0x0d), clearing the
+    values FIFO by writing 0x30 and READFIFO (0x18) on it. Every READFIFO value
+    is a 32-byte record with fwd0/rev0/rev1 and freqIndex for the sweep that
+    is configured in the sweep registers.
+
+    The reflection is either built from resonances, given as
+    (center frequency in Hz, depth in dB, loaded Q), or replayed from a curve
+    of (frequencies in Hz, magnitudes in dB), see load_curve.
+
+    Reads are delayed to the transfer time at simulated_baudrate (10 bits per
+    byte, None transfers instantly). The object offers the subset of the
+    serial.Serial interface used by LiteVNA, so it can be passed as `ser=`.
+    """
+    def __init__(self, resonances=((1.6e9, 20.0, 50.0),), curve=None, noise=1e-3,
+                 simulated_baudrate=115200, timeout=1, restart_on_clear=True, seed=None):
+        self.resonances = list(resonances)
+        self.curve = curve
+        self.noise = noise
+        self.simulated_baudrate = simulated_baudrate
+        self.timeout = timeout
+        self.restart_on_clear = restart_on_clear
+        self.is_open = True
+        self.registers = bytearray(256)
+        self.registers[REG_DEVICE_VARIANT] = 0x02
+        self.registers[REG_PROTOCOL_VERSION] = 0x01
+        self._write_value(REG_SWEEP_POINTS, 101, 2)
+        self._write_value(REG_VALUES_PER_FREQUENCY, 1, 2)
+        self._write_value(REG_AVERAGE, 1, 1)
+        self._rng = np.random.default_rng(seed)
+        self._input = bytearray()
+        self._output = bytearray()
+        self._position = 0
+        self._lock = threading.Lock()
+
+    # serial.Serial interface
+
+    @property
+    def in_waiting(self):
+        return len(self._output)
+
+    def write(self, data):
+        with self._lock:
+            self._input += data
+            self._process_input()
+        return len(data)
+
+    def read(self, size=1):
+        buffer = bytearray(size)
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        with self._lock:
+            n = min(size, len(self._output))
+            buffer[:n] = self._output[:n]
+            del self._output[:n]
+        if self.simulated_baudrate:
+            time.sleep(n * 10 / self.simulated_baudrate)
+        # a real port waits for the missing bytes until the timeout expires
+        if n < size and self.timeout:
+            time.sleep(self.timeout)
+        return n
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._output.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    # protocol
+
+    def _process_input(self):
+        while self._input:
+            opcode = self._input[0]
+            length = COMMAND_LENGTHS.get(opcode)
+            if length is None:
+                # unknown opcodes are ignored byte by byte like NOPs
+                del self._input[0]
+                continue
+            if len(self._input) < 1 + length:
+                return
+            args = bytes(self._input[1:1 + length])
+            del self._input[:1 + length]
+            self._execute(opcode, args)
+
+    def _execute(self, opcode, args):
+        if opcode == 0x0D:
+            self._output += b"2"
+        elif opcode in (0x10, 0x11, 0x12):
+            size = 1 << (opcode - 0x10)
+            address = args[0]
+            self._output += self.registers[address:address + size].ljust(size, b"\x00")
+        elif opcode == 0x18:
+            address, count = args
+            if address == REG_VALUES_FIFO:
+                self._output += self._generate_values(count)
+        elif opcode in (0x20, 0x21, 0x22, 0x23):
+            address = args[0]
+            if address == REG_VALUES_FIFO:
+                # any write to the values FIFO clears it
+                if self.restart_on_clear:
+                    self._position = 0
+                return
+            size = len(args) - 1
+            self.registers[address:address + size] = args[1:]
+            if address < REG_AVERAGE:
+                # changing the sweep restarts it
+                self._position = 0
+
+    def _write_value(self, address, value, size):
+        self.registers[address:address + size] = value.to_bytes(size, "little")
+
+    def _read_value(self, address, size):
+        return int.from_bytes(self.registers[address:address + size], "little")
+
+    # measurement model
+
+    def sweep_frequencies(self):
+        start = self._read_value(REG_SWEEP_START, 8)
+        step = self._read_value(REG_SWEEP_STEP, 8)
+        points = max(self._read_value(REG_SWEEP_POINTS, 2), 1)
+        return frequency_grid(start, step, points).hz
+
+    def s11(self, frequencies):
+        """
+        Returns the noiseless reflection coefficient of the simulated probe.
+
+        Args:
+            frequencies (np.ndarray): Frequencies in Hz.
+
+        Returns:
+            np.ndarray: Complex S11 for each frequency.
+        """
+        if self.curve is not None:
+            magnitude_db = np.interp(frequencies, self.curve[0], self.curve[1])
+            return 10 ** (magnitude_db / 20) + 0j
+        s11 = np.ones(len(frequencies), dtype=np.complex128)
+        for center, depth_db, q in self.resonances:
+            coupling = 1 - 10 ** (-depth_db / 20)
+            s11 -= coupling / (1 + 2j * q * (frequencies - center) / center)
+        return s11
+
+    def _generate_values(self, count):
+        frequencies = self.sweep_frequencies()
+        points = len(frequencies)
+        values_per_frequency = max(self._read_value(REG_VALUES_PER_FREQUENCY, 2), 1)
+        positions = self._position + np.arange(count)
+        self._position = (self._position + count) % (points * values_per_frequency)
+        freq_index = (positions // values_per_frequency) % points
+
+        # hardware averaging lowers the noise of each value
+        averages = max(self._read_value(REG_AVERAGE, 1), 1)
+        sigma = self.noise / np.sqrt(averages) * FWD0_AMPLITUDE
+        noise = self._rng.normal(0, sigma, (3, count)) + 1j * self._rng.normal(0, sigma, (3, count))
+
+        fwd0 = FWD0_AMPLITUDE * np.exp(1j * self._rng.uniform(-np.pi, np.pi, count)) + noise[0]
+        rev0 = self.s11(frequencies[freq_index]) * fwd0 + noise[1]
+        rev1 = noise[2]
+
+        records = np.zeros(count, dtype=FIFO_RECORD_DTYPE)
+        records["fwd0Re"], records["fwd0Im"] = np.rint(fwd0.real), np.rint(fwd0.imag)
+        records["rev0Re"], records["rev0Im"] = np.rint(rev0.real), np.rint(rev0.imag)
+        records["rev1Re"], records["rev1Im"] = np.rint(rev1.real), np.rint(rev1.imag)
+        records["freqIndex"] = freq_index
+        return records.tobytes()
+
+
+def serve_pty(device):
+    """
+    Exposes a simulated device on a pseudo terminal.
+
+    Args:
+        device (SimulatedLiteVNA): The device answering the commands.
+
+    Returns:
+        str: Path of the pty, which can be opened like a real port (e.g. LiteVNA(path)).
+        Pseudo terminals only exist on POSIX systems.
+    """
+    # termios is not available on Windows, the in-process simulator works without it
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    # the pty transfers instantly, so the pump applies the simulated line speed
+    device.timeout = 0
+
+    def pump():
+        while device.is_open:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                break
+            device.write(data)
+            while device.in_waiting:
+                os.write(master, device.read(device.in_waiting))
+
+    threading.Thread(target=pump, daemon=True).start()
+    return os.ttyname(slave)
+
+
+def benchmark(device, start_freq, step_freq, points, averages=2, duration=10):
+    """
+    Measures how many sweeps per second the host side sustains with LiteVNA.
+
+    Returns:
+        float: Completed sweeps per second.
+    """
+    litevna = LiteVNA(None, ser=device)
+    litevna.configure_sweep(start_freq, step_freq, points, averages)
+    sweeps = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        litevna.clear_fifo(REG_VALUES_FIFO)
+        fifo_data = litevna.read_fifo_into(REG_VALUES_FIFO, points)
+        s11, s11_magnitude_db, s11_phase = litevna.get_s11_sweep(fifo_data)
+        int(np.argmin(s11_magnitude_db))
+        sweeps += 1
+    return sweeps / (time.perf_counter() - started)
+
+
+def main():
+    start_freq = 1200000000  # 1.2 GHz
+    stop_freq = 2000000000   # 2 GHz
+    averages = 2
+    for baudrate in (115200, 921600, None):
+        for points in (201, 1001):
+            step_freq = (stop_freq - start_freq) // (points - 1)
+            device = SimulatedLiteVNA(curve=load_curve("LiteVNA_TEstData.py"), simulated_baudrate=baudrate)
+            rate = benchmark(device, start_freq, step_freq, points, averages, duration=5)
+            print(f"{baudrate or 'unlimited'} baud, {points} points: {rate:.2f} sweeps/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+from functools import lru_cache
+
+import numpy as np
+
+from LiteVNA_S11 import frequency_grid
+
+SPEED_OF_LIGHT = 299792458  # m/s
+
+
+def _window(name, points, beta):
+    if name == "kaiser":
+        return np.kaiser(points, beta)
+    elif name == "hann":
+        # without the zero end points, so gate() can undo the window
+        return np.hanning(points + 2)[1:-1]
+    elif name in (None, "none"):
+        return np.ones(points)
+    raise ValueError(f"Unknown window: {name}")
+
+
+class TimeDomainTransform:
+    """
+    Transforms S11 sweeps of one sweep configuration into the time domain.
+
+    The window, the zero-padding length and the frequency, time and distance
+    axes only depend on the sweep configuration and are computed once. The
+    window is scaled so that its coherent gain and the zero padding do not
+    change the height of a reflection. transform() accepts a single sweep or
+    a batch of sweeps as a 2-D array (one sweep per row).
+
+    Args:
+        start_freq, step_freq, points: The sweep configuration (Hz, Hz, count).
+        window (str): "kaiser", "hann" or "none".
+        beta (float): Shape of the Kaiser window, larger means lower side lobes.
+        fft_points (int): Transform length incl. zero padding, default the next
+            power of two of at least 4 * points.
+        velocity_factor (float): Propagation speed in the cable relative to c,
+            used for the distance axis.
+    """
+    def __init__(self, start_freq, step_freq, points, window="kaiser", beta=6.0, fft_points=None,
+                 velocity_factor=0.66):
+        self.start_freq = start_freq
+        self.step_freq = step_freq
+        self.points = points
+        self.fft_points = fft_points or 1 << int(np.ceil(np.log2(4 * points)))
+        if self.fft_points < points:
+            raise ValueError("fft_points must not be smaller than the number of sweep points.")
+        window = _window(window, points, beta)
+        self.window = window * (self.fft_points / window.sum())
+        self.window.flags.writeable = False
+
+        self.frequencies = frequency_grid(start_freq, step_freq, points).hz
+        # the unambiguous time range is 1 / step_freq, split into fft_points bins
+        self.times = np.arange(self.fft_points) / (self.fft_points * step_freq)
+        # a reflection travels the cable twice
+        self.distance_per_second = SPEED_OF_LIGHT * velocity_factor / 2
+        self.distances = self.times * self.distance_per_second
+        for axis in (self.times, self.distances):
+            axis.flags.writeable = False
+        self._gates = {}
+
+    def transform(self, s11):
+        """
+        Args:
+            s11 (np.ndarray): Complex S11 with `points` values in the last axis.
+
+        Returns:
+            np.ndarray: Complex time-domain response with `fft_points` values in the last axis.
+        """
+        return np.fft.ifft(s11 * self.window, n=self.fft_points, axis=-1)
+
+    def magnitude(self, s11):
+        """Magnitude of the time-domain response of one sweep or a batch."""
+        return np.abs(self.transform(s11))
+
+    def gate_window(self, start_time, stop_time, taper=0.25):
+        """
+        Returns the time gate passing start_time..stop_time (seconds), cached per gate.
+
+        Both edges fall off with a raised cosine that is taper * (stop_time - start_time) / 2
+        wide, which keeps the ringing of the gated sweep low.
+        """
+        return self._gate(start_time, stop_time, taper)[0]
+
+    def _gate(self, start_time, stop_time, taper):
+        # the gate and its renormalisation, see gate()
+        key = (start_time, stop_time, taper)
+        cached = self._gates.get(key)
+        if cached is None:
+            t = self.times
+            edge = taper * (stop_time - start_time) / 2
+            gate = ((t >= start_time) & (t <= stop_time)).astype(np.float64)
+            if edge > 0:
+                rising = (t >= start_time - edge) & (t < start_time)
+                gate[rising] = 0.5 * (1 + np.cos(np.pi * (start_time - t[rising]) / edge))
+                falling = (t > stop_time) & (t <= stop_time + edge)
+                gate[falling] = 0.5 * (1 + np.cos(np.pi * (t[falling] - stop_time) / edge))
+            # what the window and the gate leave of a flat sweep with its reflection in the
+            # middle of the gate: the gate rolled to t = 0 applied to the window's response
+            shift = int(round((start_time + stop_time) / 2 * self.fft_points * self.step_freq))
+            window_response = np.fft.ifft(self.window, n=self.fft_points)
+            norm = np.fft.fft(window_response * np.roll(gate, -shift))[:self.points]
+            gate.flags.writeable = False
+            norm.flags.writeable = False
+            cached = gate, norm
+            self._gates[key] = cached
+        return cached
+
+    def gate(self, s11, start_time, stop_time, taper=0.25):
+        """
+        Removes all reflections outside start_time..stop_time from one sweep or a batch.
+
+        The sweep is transformed to the time domain, multiplied with the gate and
+        transformed back. Instead of the bare window, the gated sweep is divided by
+        the gated window (gate-shape renormalisation): the gate smears the window
+        over the band, and dividing by the window alone would blow up the outermost
+        points where the window is small. Without a gate the sweep comes back unchanged.
+
+        Returns:
+            np.ndarray: The gated S11 with the shape of s11.
+        """
+        gate, norm = self._gate(start_time, stop_time, taper)
+        time_domain = self.transform(s11)
+        time_domain *= gate
+        return np.fft.fft(time_domain, axis=-1)[..., :self.points] / norm
+
+    def distance_to_time(self, distance):
+        """Round-trip time in seconds of a reflection at distance meters, for placing gates."""
+        return distance / self.distance_per_second
+
+
+@lru_cache(maxsize=16)
+def get_transform(start_freq, step_freq, points, window="kaiser", beta=6.0, fft_points=None, velocity_factor=0.66):
+    """
+    Returns the TimeDomainTransform of a sweep configuration, created only once.
+    """
+    return TimeDomainTransform(start_freq, step_freq, points, window, beta, fft_points, velocity_factor)
@@ -5,6 +5,7 @@ import paho.mqtt.client as mqtt
 from datetime import datetime
 import time
 import matplotlib.pyplot as plt
+from LiteVNA_S11 import frequency_grid, s11_from_fifo
 
 # MQTT Konfiguration
 MQTT_BROKER = "localhost"
@@ -93,8 +94,8 @@ def main():
         print("Initializing real-time plot...")
         plt.ion()
         fig, ax = plt.subplots()
-        freqs = np.linspace(start_freq, stop_freq, points)
-        line, = ax.plot(freqs, np.zeros(points), label="S11 Magnitude (dB)")
+        grid = frequency_grid(start_freq, step_freq, points)
+        line, = ax.plot(grid.hz, np.zeros(points), label="S11 Magnitude (dB)")
         ax.set_xlabel("Frequency (Hz)")
         ax.set_ylabel("S11 Magnitude (dB)")
         ax.set_title("Real-Time S11 Magnitude")
@@ -107,20 +108,13 @@ def main():
                 print(f"Fehler: Erwartet {32 * points} Bytes, erhalten {len(fifo_data)} Bytes")
                 continue
 
-            min_amplitude = float("inf")
-            min_freq = None
-            
-            for i in range(0, 150, 1):
-                data = fifo_data[i * 32: (i + 1) * 32]
-                amplitude = litevna.get_s11_magnitude(data)
-                freq = start_freq + i * step_freq
-                if amplitude < min_amplitude:
-                    min_amplitude = amplitude
-                    min_freq = freq
-            s11_magnitudes = []
-            for i in range(points):
-                data = fifo_data[i * 32 : (i + 1) * 32]
-                s11_magnitudes.append(litevna.get_s11_magnitude(data))
+            # decode the whole sweep at once, same thresholds as get_s11_magnitude
+            s11, s11_magnitude, s11_magnitudes, s11_phase = s11_from_fifo(fifo_data, np.complex128)
+
+            # resonance within the first 150 points
+            i = int(np.argmin(s11_magnitudes[:150]))
+            min_amplitude = float(s11_magnitudes[i])
+            min_freq = grid.frequency(i)
             # Update plot
             line.set_ydata(s11_magnitudes)
             ax.set_ylim(min(s11_magnitudes) - 1, max(s11_magnitudes) + 1)
@@ -4,6 +4,10 @@ import numpy as np
 import paho.mqtt.client as mqtt
 from datetime import datetime
 import time
+import os
+import threading
+from LiteVNA_Averaging import OutlierRejector
+from LiteVNA_S11 import FIFO_RECORD_DTYPE, FIFO_RECORD_SIZE, frequency_grid, parse_fifo_records, s11_from_fifo
 
 # MQTT Konfiguration
 MQTT_BROKER = "iot-lab-03.ei.thm.de"
@@ -27,31 +31,293 @@ calibration_data = [
 ]
 
 
+def _calibration_table(calibration_data):
+    #calibration_data as an array sorted by frequency, checked for the problems every model has
+    table = np.asarray(calibration_data, dtype=np.float64)
+    if table.ndim != 2 or table.shape[0] < 2 or table.shape[1] != 3:
+        raise ValueError("Calibration data needs at least two rows of [frequency, amplitude, moisture].")
+    if not np.isfinite(table).all():
+        raise ValueError("Calibration data contains non-finite values.")
+    return table[np.argsort(table[:, 0], kind="stable")]
+
+
+class MoistureCalibration:
+    """
+    Frequency -> moisture model built once from calibration_data.
+
+    The table is sorted by frequency, checked and converted to arrays when
+    the model is created, so evaluating it is a single np.interp call for one
+    frequency or a whole array of them. Frequencies outside the table get
+    the moisture of the nearest end.
+
+    calibration_data: rows of [frequency (GHz), amplitude (dB), moisture (%)]
+    raises ValueError if the table has fewer than two rows, non-finite values,
+    a frequency twice or a moisture that does not change monotonically with the frequency
+    """
+    def __init__(self, calibration_data):
+        table = _calibration_table(calibration_data)
+        if np.any(np.diff(table[:, 0]) <= 0):
+            raise ValueError("Calibration data contains a frequency more than once.")
+        steps = np.diff(table[:, 2])
+        if np.any(steps > 0) and np.any(steps < 0):
+            raise ValueError("Moisture of the calibration data is not monotonic in the frequency.")
+        self.frequencies = table[:, 0]
+        self.amplitudes = table[:, 1]
+        self.moistures = table[:, 2]
+        for column in (self.frequencies, self.amplitudes, self.moistures):
+            column.flags.writeable = False
+
+    def moisture(self, frequency_ghz, amplitude_db=None):
+        """
+        frequency_ghz: resonance frequency in GHz, a number or an array
+        amplitude_db: not used, for the same interface as MoistureModel2D
+        returns: moisture in % with the shape of frequency_ghz
+        """
+        return np.interp(frequency_ghz, self.frequencies, self.moistures)
+
+
+class MoistureModel2D:
+    """
+    (frequency, amplitude) -> moisture model over the scattered calibration points.
+
+    At high moisture the resonance frequency hardly moves while the amplitude
+    still changes a lot, so both features are used. The moisture is the
+    inverse-distance weighted mean of the calibration points, with both
+    features scaled to the range they span in the table (amplitude_weight
+    scales the amplitude axis further). It is computed once on a
+    grid_points x grid_points grid covering the table plus margin on every
+    side; a lookup only interpolates bilinearly between four grid values,
+    for one reading or whole arrays. Readings outside the grid are clamped to its edge.
+
+    calibration_data: rows of [frequency (GHz), amplitude (dB), moisture (%)]
+    power: exponent of the inverse distance weights, larger follows the nearest point more closely
+    raises ValueError if the table has fewer than two rows or non-finite values
+    """
+    def __init__(self, calibration_data, grid_points=256, power=2, amplitude_weight=1.0, margin=0.1):
+        table = _calibration_table(calibration_data)
+        self.power = power
+        self.amplitude_weight = amplitude_weight
+        low = table[:, :2].min(axis=0)
+        high = table[:, :2].max(axis=0)
+        span = np.where(high > low, high - low, 1.0)
+        low = low - margin * span
+        high = high + margin * span
+        self._origin = low
+        self._step = (high - low) / (grid_points - 1)
+        self.frequencies = np.linspace(low[0], high[0], grid_points)
+        self.amplitudes = np.linspace(low[1], high[1], grid_points)
+
+        # distances in table ranges, one axis per feature
+        scale = np.array([1.0, amplitude_weight]) / span
+        points = table[:, :2] * scale
+        grid_f, grid_a = np.meshgrid(self.frequencies * scale[0], self.amplitudes * scale[1], indexing="ij")
+        distance = np.hypot(grid_f[..., None] - points[:, 0], grid_a[..., None] - points[:, 1])
+        with np.errstate(divide="ignore"):
+            weights = distance ** -float(power)
+        # a grid node on a calibration point takes its moisture
+        exact = np.isinf(weights)
+        hit = exact.any(axis=-1)
+        weights[hit] = exact[hit]
+        self.grid = weights @ table[:, 2] / weights.sum(axis=-1)
+        for array in (self.frequencies, self.amplitudes, self.grid):
+            array.flags.writeable = False
+
+    def moisture(self, frequency_ghz, amplitude_db):
+        """
+        frequency_ghz, amplitude_db: resonance frequency in GHz and its amplitude in dB,
+        numbers or arrays of the same shape
+        returns: moisture in % with the shape of the inputs, NaN where an input is not finite
+        """
+        n_f, n_a = self.grid.shape
+        frequency_ghz, amplitude_db = np.broadcast_arrays(np.asarray(frequency_ghz, dtype=np.float64),
+                                                          np.asarray(amplitude_db, dtype=np.float64))
+        valid = np.isfinite(frequency_ghz) & np.isfinite(amplitude_db)
+        #non-finite inputs are looked up at the grid origin and replaced by NaN afterwards
+        x = np.clip(np.where(valid, (frequency_ghz - self._origin[0]) / self._step[0], 0), 0, n_f - 1)
+        y = np.clip(np.where(valid, (amplitude_db - self._origin[1]) / self._step[1], 0), 0, n_a - 1)
+        i = np.minimum(x.astype(np.intp), n_f - 2)
+        j = np.minimum(y.astype(np.intp), n_a - 2)
+        tx = x - i
+        ty = y - j
+        g = self.grid
+        moisture = ((g[i, j] * (1 - ty) + g[i, j + 1] * ty) * (1 - tx)
+                    + (g[i + 1, j] * (1 - ty) + g[i + 1, j + 1] * ty) * tx)
+        return np.where(valid, moisture, np.nan)[()]
+
+
+moisture_calibration = MoistureCalibration(calibration_data)
+
+
+def load_calibration_table(filename):
+    """
+    Reads a calibration table file with one row of frequency (GHz), amplitude (dB)
+    and moisture (%) per line, separated by ';' or ','. Empty lines, lines starting
+    with '#' and a header line are skipped.
+
+    returns: the rows as a list like calibration_data
+    raises ValueError if a line cannot be read
+    """
+    rows = []
+    with open(filename, newline="") as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.replace(",", ";").split(";")
+            try:
+                rows.append([float(field) for field in fields])
+            except ValueError:
+                if rows:
+                    raise ValueError(f"{filename}:{number}: cannot read calibration row {line!r}") from None
+                #header
+    return rows
+
+
+class CalibrationRegistry:
+    """
+    Moisture models of several probes, loaded from files and reloaded when they change.
+
+    The table of a probe is `<directory>/<device_id>.csv` (see
+    load_calibration_table), directory defaults to calibration/ next to this
+    script; probes without a file use `default`. get() checks
+    the modification time of a file at most every check_interval seconds and
+    only then rebuilds the model, so calling it for every sweep is cheap.
+    A new model replaces the old one in a single assignment, readers never see
+    a half-built model, and a table that fails to load keeps the previous
+    model in use, so acquisition goes on while tables are edited.
+
+    model: class building a model from a table, MoistureCalibration or MoistureModel2D
+    """
+    def __init__(self, directory=None, model=MoistureCalibration, default=None, check_interval=5.0):
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration")
+        self.directory = directory
+        self.model = model
+        self.default = moisture_calibration if default is None else default
+        self.check_interval = check_interval
+        #device_id -> (model, (mtime, size) of its file or None, time of the last check)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def path(self, device_id):
+        return os.path.join(self.directory, f"{device_id}.csv")
+
+    def _stamp(self, device_id):
+        try:
+            stat = os.stat(self.path(device_id))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, device_id):
+        """
+        returns: the current moisture model of the probe
+        """
+        entry = self._entries.get(device_id)
+        now = time.monotonic()
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[0]
+        with self._lock:
+            entry = self._entries.get(device_id)
+            stamp = self._stamp(device_id)
+            if entry is not None and stamp == entry[1]:
+                model = entry[0]
+            elif stamp is None:
+                model = self.default
+            else:
+                try:
+                    model = self.model(load_calibration_table(self.path(device_id)))
+                    print(f"Calibration of {device_id} loaded from {self.path(device_id)}")
+                except (OSError, ValueError) as error:
+                    print(f"Calibration of {device_id} not reloaded: {error}")
+                    model = entry[0] if entry is not None else self.default
+            self._entries[device_id] = (model, stamp, now)
+        return model
+
+    def moisture(self, device_id, frequency_ghz, amplitude_db=None):
+        """Moisture in % of a probe, see MoistureCalibration.moisture."""
+        return self.get(device_id).moisture(frequency_ghz, amplitude_db)
+
+
 def calculate_moisture_from_amplitude(measured_frequ, calibration_data):
     """
     Calculates the moisture percentage for a given measured frequence using
     linear interpolation based on calibration_data.
     
-    calibration_data: 2D array where each row is [frequency (GHz), amplitude (dB), moisture (%)]
+    calibration_data: a MoistureCalibration or a 2D array where each row is
+    [frequency (GHz), amplitude (dB), moisture (%)]; pass a MoistureCalibration
+    to avoid preparing the table on every call
     """
-    # Ensure the calibration data is sorted in ascending order by amplitude.
-    sorted_data = sorted(calibration_data, key=lambda x: x[0])
-    calib_frequ = [row[0] for row in sorted_data]
-    calib_amps = [row[1] for row in sorted_data]
-    calib_moisture = [row[2] for row in sorted_data]
-    
-    # Use numpy.interp to linearly interpolate the moisture value.
-    moisture = np.interp(measured_frequ, calib_frequ, calib_amps, calib_moisture)
-    return moisture
+    if not isinstance(calibration_data, MoistureCalibration):
+        calibration_data = MoistureCalibration(calibration_data)
+    return calibration_data.moisture(measured_frequ)
+
+def align_fifo_records(fifo_data, points):
+    """
+    Finds the 32-byte records in a buffer that lost or gained bytes.
+
+    A record is accepted where its freqIndex is below points and the record 32 bytes
+    after (or before) it carries the next (or previous) freqIndex.
+
+    returns: structured array (FIFO_RECORD_DTYPE) of the accepted records
+    """
+    data = np.frombuffer(fifo_data, dtype=np.uint8)
+    starts = len(data) - FIFO_RECORD_SIZE + 1
+    if starts <= 0:
+        return np.zeros(0, dtype=FIFO_RECORD_DTYPE)
+    #freqIndex of a record beginning at every byte offset
+    index = data[24:24 + starts].astype(np.int64) | (data[25:25 + starts].astype(np.int64) << 8)
+    plausible = index < points
+    following = np.zeros(starts, dtype=bool)
+    following[:-FIFO_RECORD_SIZE] = (plausible[:-FIFO_RECORD_SIZE]
+                                     & (index[FIFO_RECORD_SIZE:] == (index[:-FIFO_RECORD_SIZE] + 1) % points))
+    preceding = np.zeros(starts, dtype=bool)
+    preceding[FIFO_RECORD_SIZE:] = following[:-FIFO_RECORD_SIZE]
+    candidates = np.flatnonzero(plausible & (following | preceding))
+
+    #walk through the buffer, skipping bytes until the next accepted record
+    offsets = []
+    position = 0
+    while True:
+        k = np.searchsorted(candidates, position)
+        if k == len(candidates):
+            break
+        offsets.append(candidates[k])
+        position = candidates[k] + FIFO_RECORD_SIZE
+    if not offsets:
+        return np.zeros(0, dtype=FIFO_RECORD_DTYPE)
+    blocks = data[np.add.outer(np.array(offsets), np.arange(FIFO_RECORD_SIZE))]
+    return blocks.view(FIFO_RECORD_DTYPE).ravel()
+
+def decode_sweep(fifo_data, missing=None):
+    """
+    Decodes a complete FIFO buffer in one pass instead of point by point.
+
+    fifo_data: bytes-like object holding consecutive 32-byte FIFO records
+    missing: optional boolean array marking gaps (see LiteVNA.read_sweep), which become NaN
+    returns: (s11, s11_magnitude_db, s11_phase) as NumPy arrays, one entry per record
+    """
+    #same thresholds as LiteVNA.get_s11_magnitude, but applied to the whole array
+    s11, s11_magnitude, s11_magnitude_db, s11_phase = s11_from_fifo(fifo_data, np.complex128, unwrap=False)
+    if missing is not None:
+        s11[missing] = np.nan
+        s11_magnitude_db[missing] = np.nan
+        s11_phase[missing] = np.nan
+    return s11, s11_magnitude_db, s11_phase
 
 class LiteVNA:
-    def __init__(self, port, baudrate=115200, timeout=1):
-        self.ser = serial.Serial(port, baudrate, timeout=timeout)
+    def __init__(self, port, baudrate=115200, timeout=1, ser=None):
+        #ser: already opened serial-like object (e.g. a simulated device) used instead of port
+        self.ser = ser if ser is not None else serial.Serial(port, baudrate, timeout=timeout)
+        #shadow copy of the device registers written so far: address -> (value, length)
+        self.registers = {}
+        #points kept from damaged sweeps and points lost as gaps, see read_sweep
+        self.recovered_points = 0
+        self.dropped_points = 0
         self._initialize_calibration()
 
     def _initialize_calibration(self):
-        command = struct.pack("BBB", 0x20, 0x26, 0x03)
-        self.send_command(command)
+        self.write_register(0x26, 0x03, 1)
         #print("Calibration mode enabled (0x20 0x26 0x03 sent).")
 
     def close(self):
@@ -64,30 +330,147 @@ class LiteVNA:
     def read_response(self, length):
         return self.ser.read(length)
 
-    #write values in register corresponding to LiteVNA user guide
-    def write_register(self, address, value, length):
+    #build the write command for one register corresponding to LiteVNA user guide
+    def _register_command(self, address, value, length):
         if length == 1:
-            command = struct.pack("B", 0x20) + struct.pack("B", address) + struct.pack("B", value)
+            return struct.pack("B", 0x20) + struct.pack("B", address) + struct.pack("B", value)
         elif length == 2:
-            command = struct.pack("B", 0x21) + struct.pack("B", address) + struct.pack("<H", value)
+            return struct.pack("B", 0x21) + struct.pack("B", address) + struct.pack("<H", value)
         elif length == 4:
-            command = struct.pack("B", 0x22) + struct.pack("B", address) + struct.pack("<I", value)
+            return struct.pack("B", 0x22) + struct.pack("B", address) + struct.pack("<I", value)
         elif length == 8:
-            command = struct.pack("B", 0x23) + struct.pack("B", address) + value.to_bytes(8, "little")
+            return struct.pack("B", 0x23) + struct.pack("B", address) + value.to_bytes(8, "little")
         else:
             raise ValueError("Unsupported register length.")
-        self.send_command(command)
+
+    #write values in register corresponding to LiteVNA user guide
+    def write_register(self, address, value, length):
+        self.write_registers([(address, value, length)])
+
+    #write several registers with a single serial write
+    def write_registers(self, registers, force=False):
+        """
+        Packs the commands for all changed registers into one write.
+
+        registers: iterable of (address, value, length)
+        force: also write registers whose shadow copy already holds the value
+        returns: number of registers actually written
+        """
+        commands = bytearray()
+        written = {}
+        for address, value, length in registers:
+            if not force and self.registers.get(address) == (value, length):
+                continue
+            commands += self._register_command(address, value, length)
+            written[address] = (value, length)
+        if commands:
+            self.send_command(commands)
+            self.registers.update(written)
+        return len(written)
 
     #read the fifo values according to the LiteVNA user guide
+    #count is the number of 32-byte values, as in the count field of the 0x18 command
     def read_fifo(self, address, count):
-        data = b""
-        while count > 0:
-            chunk_size = min(count, 255)
-            command = struct.pack("B", 0x18) + struct.pack("B", address) + struct.pack("B", chunk_size)
-            self.send_command(command)
-            data += self.read_response(chunk_size)
-            count -= chunk_size
-        return data
+        return bytes(self.read_fifo_into(address, count))
+
+    #queue all READFIFO commands at once and collect the replies in one preallocated buffer
+    def read_fifo_into(self, address, count, aligned=True):
+        """
+        Bulk variant of read_fifo without a round trip per chunk.
+
+        count: number of FIFO values to read; each 0x18 command requests up to 255 values
+        and is answered with 32 bytes per value
+        aligned: drop a trailing partial record; False returns every received byte
+        returns: memoryview of the received whole records (fewer than count on a timeout),
+        which can be passed to get_s11_sweep without copying
+        """
+        commands = bytearray()
+        remaining = count
+        while remaining > 0:
+            chunk_size = min(remaining, 255)
+            commands += struct.pack("BBB", 0x18, address, chunk_size)
+            remaining -= chunk_size
+        self.send_command(commands)
+
+        expected = FIFO_RECORD_SIZE * count
+        buffer = memoryview(bytearray(expected))
+        received = 0
+        while received < expected:
+            n = self.ser.readinto(buffer[received:])
+            #nothing arrived before the serial timeout
+            if not n:
+                break
+            received += n
+
+        if not aligned:
+            return buffer[:received]
+        #drop a trailing partial record so the result stays aligned to whole values
+        return buffer[:received - received % FIFO_RECORD_SIZE]
+
+    #read one sweep and keep the valid points if values were lost on the way
+    def read_sweep(self, points, retries=1):
+        """
+        Reads points values from the values FIFO and orders them by freqIndex.
+
+        If the reply is incomplete or misaligned, the record boundaries are searched
+        with the freqIndex sequence (see align_fifo_records) and the valid points are kept.
+        The FIFO only delivers values in sweep order, so for every retry just enough
+        further values are read to pass the missing indices once more. Values lost on
+        the way were taken out of the FIFO all the same, so its position follows from
+        the number of values requested, not from the records that arrived.
+
+        returns: (fifo_data, missing) where fifo_data holds points records in freqIndex
+        order and missing is a boolean array marking the gaps (their records are zero)
+        """
+        fifo_data = self.read_fifo_into(0x30, points, aligned=False)
+        if len(fifo_data) == FIFO_RECORD_SIZE * points:
+            records = np.frombuffer(fifo_data, dtype=FIFO_RECORD_DTYPE)
+            if np.array_equal(records["freqIndex"], np.arange(points)):
+                return fifo_data, np.zeros(points, dtype=bool)
+
+        sweep = np.zeros(points, dtype=FIFO_RECORD_DTYPE)
+        missing = np.ones(points, dtype=bool)
+        start = self._place_records(fifo_data, sweep, missing)
+        #a complete reply that only started at another freqIndex is not counted as damaged
+        if not missing.any():
+            return sweep.tobytes(), missing
+        for _ in range(retries):
+            #nothing usable arrived, the device does not answer at all
+            if not missing.any() or start is None:
+                break
+            #points values were taken out, so the FIFO is at the index it started at again;
+            #read until the last gap came round
+            needed = int(np.max((np.flatnonzero(missing) - start) % points)) + 1
+            self._place_records(self.read_fifo_into(0x30, needed, aligned=False), sweep, missing, start)
+            start = (start + needed) % points
+
+        dropped = int(missing.sum())
+        self.recovered_points += points - dropped
+        self.dropped_points += dropped
+        return sweep.tobytes(), missing
+
+    #copy the valid records of fifo_data into the gaps of sweep
+    #expected: freqIndex the reply should start with, lets a reply of a single record through
+    #returns the freqIndex of the first value the device sent, estimated from the first valid record
+    def _place_records(self, fifo_data, sweep, missing, expected=None):
+        points = len(sweep)
+        records = align_fifo_records(fifo_data, points)
+        if len(records) == 0:
+            #align_fifo_records needs a neighbour to trust a record
+            if expected is None or len(fifo_data) != FIFO_RECORD_SIZE:
+                return None
+            records = parse_fifo_records(fifo_data)
+            if records["freqIndex"][0] != expected:
+                return None
+            records = records.copy()
+        indices = records["freqIndex"]
+        new = missing[indices]
+        sweep[indices[new]] = records[new]
+        missing[indices] = False
+        #whole records before the first valid one, bytes lost ahead of it count as a started record
+        offset = bytes(fifo_data).find(records[:1].tobytes())
+        started_records = -(-offset // FIFO_RECORD_SIZE)
+        return int(indices[0] - started_records) % points
 
     def clear_fifo(self, address):
         command = struct.pack("B", 0x20) + struct.pack("B", address) + struct.pack("B", 0x00)
@@ -95,13 +478,67 @@ class LiteVNA:
 
     #configure sweep measurement for frequency domain
     def configure_sweep(self, start_freq, step_freq, points, averages=2):
-        self.write_register(0x00, start_freq, 8) #start frequency
-        self.write_register(0x10, step_freq, 8) #steps
-        self.write_register(0x20, points, 2) #number of points
-        self.write_register(0x22, 1, 2) 
-        self.write_register(0x40, averages, 1) #set average
-        self.write_register(0x41, 0x01, 1)
-        self.write_register(0x42, 0x03, 1)
+        #only registers that differ from the shadow copy are sent
+        self.write_registers([
+            (0x00, start_freq, 8), #start frequency
+            (0x10, step_freq, 8), #steps
+            (0x20, points, 2), #number of points
+            (0x22, 1, 2),
+            (0x40, averages, 1), #set average
+            (0x41, 0x01, 1),
+            (0x42, 0x03, 1),
+        ])
+
+    #continuously drain the values FIFO and reassemble complete sweeps using freqIndex
+    def stream_sweeps(self, points, chunk_values=None, max_empty_reads=3):
+        """
+        Generator yielding one bytes object of points 32-byte records per complete sweep,
+        ordered by freqIndex, without clearing the FIFO between sweeps.
+
+        points: number of sweep points configured on the device
+        chunk_values: number of values requested per read (default: points)
+        max_empty_reads: consecutive reads without a usable record after which the
+        device counts as stalled
+        Records before the first freqIndex 0 and sweeps with missing indices are discarded.
+        Every read is realigned with align_fifo_records, so lost or late bytes only cost
+        the records they damage.
+
+        raises: serial.SerialException if the device stalled, so LiteVNASession.stream reconnects
+        """
+        chunk_values = chunk_values or points
+        sweep = np.zeros(points, dtype=FIFO_RECORD_DTYPE)
+        filled = np.zeros(points, dtype=bool)
+        synced = False
+        last_index = -1
+        empty_reads = 0
+        while True:
+            fifo_data = self.read_fifo_into(0x30, chunk_values, aligned=False)
+            records = align_fifo_records(fifo_data, points)
+            if len(records) == 0:
+                empty_reads += 1
+                if empty_reads >= max_empty_reads:
+                    raise serial.SerialException(f"No values from the LiteVNA in {empty_reads} reads")
+                continue
+            empty_reads = 0
+            indices = records["freqIndex"].astype(np.int64)
+            #a new sweep starts wherever freqIndex does not increase
+            bounds = [0, *np.flatnonzero(np.diff(indices, prepend=last_index) <= 0), len(records)]
+            for n in range(len(bounds) - 1):
+                segment = slice(bounds[n], bounds[n + 1])
+                if bounds[n] == bounds[n + 1]:
+                    continue
+                if n > 0 or (not synced and indices[bounds[n]] == 0):
+                    #an unfinished sweep is dropped when the next one begins
+                    filled[:] = False
+                    synced = True
+                if not synced:
+                    continue
+                sweep[indices[segment]] = records[segment]
+                filled[indices[segment]] = True
+                if filled.all():
+                    yield sweep.tobytes()
+                    filled[:] = False
+            last_index = indices[-1]
 
     #returns the magnitude of S11
     def get_s11_magnitude(self, fifo_data):
@@ -121,66 +558,194 @@ class LiteVNA:
         #return the magnitude as result
         return s11_magnitude_db
 
+    #returns S11, its magnitude in dB and its phase for a whole sweep at once
+    def get_s11_sweep(self, fifo_data, missing=None):
+        return decode_sweep(fifo_data, missing)
+
+class LiteVNASession:
+    """
+    Keeps one LiteVNA connection open across measurement cycles.
+
+    After a SerialException the port is closed and reopened with an increasing
+    delay (min_backoff doubling up to max_backoff). The register shadow of the
+    LiteVNA makes configure_sweep send nothing when the sweep parameters did not
+    change; after a reconnect the shadow starts empty and everything is written again.
+
+    ser: instead of opening port, use this serial-like object (e.g. a simulated
+    device), or call it to get a freshly opened one on every (re)connect. An
+    object passed in directly cannot be reopened once closed, so a lost
+    connection raises SerialException instead of reconnecting.
+
+    reconnect: with False, connect() tries once and a lost connection is closed
+    and raised as SerialException, so the caller can count the error and
+    schedule the next attempt itself (see AsyncLiteVNA).
+    """
+    def __init__(self, port, baudrate=115200, timeout=1, min_backoff=1, max_backoff=60, ser=None,
+                 reconnect=True):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.ser = ser
+        self.litevna = None
+        self._backoff = min_backoff
+        self._reconnectable = reconnect and (ser is None or callable(ser))
+        self._used = False
+
+    def _open_serial(self):
+        #None lets LiteVNA open the port itself
+        if callable(self.ser):
+            return self.ser()
+        if self.ser is not None:
+            if self._used:
+                raise serial.SerialException("The serial object passed as ser was closed and cannot be reopened")
+            self._used = True
+        return self.ser
+
+    def connect(self):
+        #open the port, waiting longer after every failed attempt
+        while self.litevna is None:
+            try:
+                self.litevna = LiteVNA(self.port, self.baudrate, self.timeout, ser=self._open_serial())
+            except serial.SerialException as error:
+                if not self._reconnectable:
+                    raise
+                print(f"No LiteVNA connection ({error}), retrying in {self._backoff} s")
+                self._wait_backoff()
+        return self.litevna
+
+    def close(self):
+        if self.litevna is not None:
+            try:
+                self.litevna.close()
+            except serial.SerialException:
+                pass
+        self.litevna = None
+
+    def _wait_backoff(self):
+        time.sleep(self._backoff)
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def configure_sweep(self, start_freq, step_freq, points, averages=2):
+        litevna = self.connect()
+        litevna.configure_sweep(start_freq, step_freq, points, averages)
+        return litevna
+
+    #measure one sweep, reconnecting until the device answers
+    #returns (fifo_data, missing) as LiteVNA.read_sweep
+    def sweep(self, start_freq, step_freq, points, averages=2):
+        while True:
+            try:
+                litevna = self.configure_sweep(start_freq, step_freq, points, averages)
+                litevna.clear_fifo(0x30)
+                fifo_data, missing = litevna.read_sweep(points)
+                self._backoff = self.min_backoff
+                return fifo_data, missing
+            except serial.SerialException as error:
+                if not self._reconnectable:
+                    self.close()
+                    raise
+                print(f"LiteVNA connection lost ({error}), reconnecting in {self._backoff} s")
+                self.close()
+                self._wait_backoff()
+
+    #stream complete sweeps without clearing the FIFO in between, reconnecting until the device answers
+    def stream(self, start_freq, step_freq, points, averages=2):
+        while True:
+            try:
+                litevna = self.configure_sweep(start_freq, step_freq, points, averages)
+                #only cleared once; afterwards freqIndex keeps the sweeps apart
+                litevna.clear_fifo(0x30)
+                for fifo_data in litevna.stream_sweeps(points):
+                    self._backoff = self.min_backoff
+                    yield fifo_data
+            except serial.SerialException as error:
+                if not self._reconnectable:
+                    self.close()
+                    raise
+                print(f"LiteVNA connection lost ({error}), reconnecting in {self._backoff} s")
+                self.close()
+                self._wait_backoff()
+
+#find the resonance of one decoded sweep and format the MQTT message for it
+#estimator: optional function (frequencies, s11_magnitude_db) -> (frequency, depth, goodness),
+#e.g. LiteVNA_Resonance.estimate_resonance, used instead of the raw minimum
+#model: moisture model passed on to format_measurement, e.g. CalibrationRegistry.get(device_id)
+def evaluate_sweep(s11_magnitude_db, start_freq, step_freq, estimator=None, model=None):
+    grid = frequency_grid(start_freq, step_freq, len(s11_magnitude_db))
+    if estimator is not None:
+        min_freq, min_amplitude, goodness = estimator(grid.hz, s11_magnitude_db)
+    else:
+        #index of the lowest amplitude, gaps of a recovered sweep are NaN
+        i = int(np.nanargmin(s11_magnitude_db))
+        min_amplitude = float(s11_magnitude_db[i])
+        min_freq = grid.frequency(i)
+    return format_measurement(min_freq, min_amplitude, model)
+
+#calculate the moisture for a resonance (Hz, dB) and format the MQTT message for it
+#model: MoistureCalibration (frequency only, the default) or MoistureModel2D (frequency and amplitude)
+def format_measurement(min_freq, min_amplitude, model=None):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    measured_freq_GHz = min_freq / 1e9
+    model = moisture_calibration if model is None else model
+    moisture = model.moisture(measured_freq_GHz, min_amplitude)
+    return f"{timestamp};{measured_freq_GHz} GHz;{min_amplitude} dB; {moisture}% "
+
+def publish_message(message):
+    #Mqtt client connection
+    try:
+        client = mqtt.Client()
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        client.publish(MQTT_TOPIC, message)
+        client.disconnect()
+        print(f"Data sent: {message}")
+    except:
+        print("No MQTT connection")
+
 def main():
     #port = "/dev/ttyUSB0"  # Replace with actual LiteVNA port
     port = "COM3"
+    session = LiteVNASession(port)
+    start_freq = 1200000000  # 1.2 GHz
+    stop_freq = 2000000000   # 2 GHz
+    points = 201
+    step_freq = (stop_freq - start_freq) // (points - 1)
+    averages = 2
+    #calibration table of the probe: calibration/probe1.csv, picked up while running when it changes
+    device_id = "probe1"
+    calibrations = CalibrationRegistry()
+    #drops single bad sweeps (USB glitches, touching the probe) before they are published
+    rejector = OutlierRejector(points)
     while True:
         try:
-            
-            litevna = LiteVNA(port)
-            start_freq = 1200000000  # 1.2 GHz
-            stop_freq = 2000000000   # 2 GHz
-            points = 201
-            step_freq = (stop_freq - start_freq) // (points - 1)
-            averages = 2
-            litevna.configure_sweep(start_freq, step_freq, points, averages)
-
-        
-            litevna.clear_fifo(0x30)
-            fifo_data = litevna.read_fifo(0x30, 32 * points)
-            if len(fifo_data) != 32 * points:
-                print(f"Error: Expected {32 * points} Bytes, received {len(fifo_data)} Bytes")
+            #the port stays open and the registers are only written when the parameters change
+            fifo_data, missing = session.sweep(start_freq, step_freq, points, averages)
+            if missing.all():
+                print(f"Error: No valid values received out of {points}")
                 continue
+            if missing.any():
+                print(f"Warning: {int(missing.sum())} of {points} points missing "
+                      f"(recovered {session.litevna.recovered_points}, dropped {session.litevna.dropped_points} in total)")
 
-            min_amplitude = float("inf")
-            min_freq = None
-            
-            #loop over all 201 measuring points
-            for i in range(points):
-                #raw fifo data
-                data = fifo_data[i * 32: (i + 1) * 32]
-                #calculate S11 magnitude
-                amplitude = litevna.get_s11_magnitude(data)
-                freq = start_freq + i * step_freq
-                #set lowest frequency to current, if it is lower
-                if amplitude < min_amplitude:
-                    min_amplitude = amplitude
-                    min_freq = freq
-            
-            if min_freq is not None:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                measured_freq_GHz = min_freq / 1e9
-                # Calculate moisture using the new 2D calibration array.
-                moisture = calculate_moisture_from_amplitude(measured_freq_GHz, calibration_data)
-                message = f"{timestamp};{measured_freq_GHz} GHz;{min_amplitude} dB; {moisture}% "
-                print(message)
-                #Mqtt client connection
-                try:
-                    client = mqtt.Client()
-                    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-                    client.publish(MQTT_TOPIC, message)
-                    client.disconnect()
-                    print(f"Data sent: {message}")
-                except:
-                    print("No MQTT connection")
+            #decode all 201 measuring points at once
+            s11, s11_magnitude_db, s11_phase = session.litevna.get_s11_sweep(fifo_data, missing)
+            if not rejector.accept(s11_magnitude_db):
+                print(f"Warning: sweep rejected, {rejector.outlier_fraction:.0%} of the points deviate from the last sweeps")
+                continue
+            message = evaluate_sweep(s11_magnitude_db, start_freq, step_freq, model=calibrations.get(device_id))
+            print(message)
+            publish_message(message)
             
             time.sleep(2)
+        except KeyboardInterrupt:
+            print("\nTerminating...")
+            break
         except Exception as error:
             print("No LiteVNA connection " + str(error))
+            session.close()
             time.sleep(2)
-        
-            
-    
+    session.close()
 
 if __name__ == "__main__":
     main()
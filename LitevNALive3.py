@@ -1,11 +1,12 @@
 import serial
 import struct
-import cmath
 import csv
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-import math
 import time
+import numpy as np
+from LiteVNA_Averaging import SweepAverager
+from LiteVNA_S11 import frequency_grid, parse_fifo_records, s11_from_fifo, s11_to_polar
 
 def send_command(ser, command_bytes):
     """
@@ -40,90 +41,45 @@ def read_response(ser, expected_length=1):
         print(f"Error reading response: {e}")
         return b''
 
-def parse_fifo_block(block):
+def configure_sweep(ser, start_freq, freq_step, num_values, averages=2):
     """
-    Parses a 32-byte FIFO block from the LiteVNA.
+    Configures the frequency sweep, so every read of num_values values covers the same frequencies.
 
     Args:
-        block (bytes): A 32-byte data block from the valuesFIFO.
-
-    Returns:
-        dict: Parsed data fields as a dictionary.
+        ser (serial.Serial): The open serial connection.
+        start_freq (int): First frequency in Hz.
+        freq_step (int): Frequency step in Hz.
+        num_values (int): Number of sweep points.
+        averages (int): Number of averages per point on the device.
     """
-    if len(block) != 32:
-        raise ValueError("Block size must be 32 bytes.")
-
-    data = {
-        "fwd0Re": struct.unpack('<i', block[0:4])[0],
-        "fwd0Im": struct.unpack('<i', block[4:8])[0],
-        "rev0Re": struct.unpack('<i', block[8:12])[0],
-        "rev0Im": struct.unpack('<i', block[12:16])[0],
-        "rev1Re": struct.unpack('<i', block[16:20])[0],
-        "rev1Im": struct.unpack('<i', block[20:24])[0],
-        "freqIndex": struct.unpack('<H', block[24:26])[0],
-    }
-
-    return data
-
-def update_plot(frame, ser, line_mag, line_phase, freq_data, magnitude_data_db, phase_data, num_values, start_freq, freq_step):
-    try:
-        magnitude_data_db.clear()
-        phase_data.clear()
-
-        for _ in range(2):  # Perform 8 measurements
-            send_command(ser, b'\x18\x30' + num_values.to_bytes(2, 'little'))
-            raw_response = read_response(ser, expected_length=num_values * 32)
-
-            parsed_data = []
-            for i in range(num_values):
-                block = raw_response[i * 32:(i + 1) * 32]
-                parsed_data.append(parse_fifo_block(block))
-
-            for entry in parsed_data:
-                fwd0 = complex(entry["fwd0Re"], entry["fwd0Im"])
-                rev0 = complex(entry["rev0Re"], entry["rev0Im"])
-
-                # Normalize rev0 with fwd0
-                normalized = rev0 / fwd0
-
-                # Convert to polar
-                magnitude = abs(normalized)
-                phase = cmath.phase(normalized)
+    send_command(ser, struct.pack("<BBQ", 0x23, 0x00, start_freq))  # sweepStartHz
+    send_command(ser, struct.pack("<BBQ", 0x23, 0x10, freq_step))  # sweepStepHz
+    send_command(ser, struct.pack("<BBH", 0x21, 0x20, num_values))  # sweepPoints
+    send_command(ser, struct.pack("<BBH", 0x21, 0x22, 1))  # valuesPerFrequency
+    send_command(ser, struct.pack("BBB", 0x20, 0x40, averages))  # Average
 
-                # Convert magnitude to dB
-                magnitude_db = 20 * math.log10(magnitude) if magnitude > 0 else -float('inf')
-
-                magnitude_data_db.append(magnitude_db)
-                phase_data.append(phase)
-        
-        offset_value = 1
-        send_command(ser, b'\x18\x30' + offset_value.to_bytes(2, 'little'))
-        raw_response = read_response(ser, expected_length=offset_value * 32)
-
-        parsed_data = []
-        for i in range(offset_value):
-            block = raw_response[i * 32:(i + 1) * 32]
-            parsed_data.append(parse_fifo_block(block))
-
-        for entry in parsed_data:
-            fwd0 = complex(entry["fwd0Re"], entry["fwd0Im"])
-            rev0 = complex(entry["rev0Re"], entry["rev0Im"])
-
-            # Normalize rev0 with fwd0
-            normalized = rev0 / fwd0
-
-            # Convert to polar
-            magnitude = abs(normalized)
-            phase = cmath.phase(normalized)
-
-            # Convert magnitude to dB
-            magnitude_db = 20 * math.log10(magnitude) if magnitude > 0 else -float('inf')
-
-            magnitude_data_db.append(magnitude_db)
-            phase_data.append(phase)
+def update_plot(frame, ser, line_mag, line_phase, freq_data, magnitude_data_db, phase_data, num_values, start_freq, freq_step, averager):
+    try:
+        # Clear the FIFO so the read starts with the next sweep instead of anywhere in the free-running FIFO
+        send_command(ser, b'\x20\x30\x00')
+        send_command(ser, b'\x18\x30' + num_values.to_bytes(2, 'little'))
+        raw_response = read_response(ser, expected_length=num_values * 32)
+
+        # Only a complete sweep is averaged, ordered by freqIndex so position i is always the same frequency
+        records = parse_fifo_records(raw_response)
+        indices = records["freqIndex"]
+        if len(records) != num_values or not np.array_equal(np.sort(indices), np.arange(num_values)):
+            print(f"Incomplete sweep ({len(records)} of {num_values} values), not averaged")
+            return [line_mag, line_phase]
+
+        # Normalize rev0 with fwd0 and average the complex sweep with the previous ones
+        s11, magnitude, magnitude_db, phase = s11_from_fifo(records[np.argsort(indices)].tobytes())
+        magnitude, magnitude_db, phase = s11_to_polar(averager.update(s11))
+        magnitude_data_db[:] = magnitude_db
+        phase_data[:] = phase
 
         # Update lines
-        freq_data = [start_freq + i * freq_step for i in range(len(magnitude_data_db))]
+        freq_data = frequency_grid(start_freq, freq_step, len(magnitude_data_db)).hz
         line_mag.set_data(freq_data, magnitude_data_db)
         line_phase.set_data(freq_data, phase_data)
 
@@ -140,8 +96,8 @@ def main():
     TIMEOUT = 1
 
     # Frequency parameters
-    START_FREQ = 1.6e9  # 1.6 GHz
-    FREQ_STEP = 1e6  # 1 MHz per step
+    START_FREQ = 1600000000  # 1.6 GHz
+    FREQ_STEP = 1000000  # 1 MHz per step
 
     try:
         # Open the serial connection
@@ -151,15 +107,18 @@ def main():
             # Initialize plot
             fig, ax = plt.subplots(figsize=(12, 6))
             num_values = 100
+            configure_sweep(ser, START_FREQ, FREQ_STEP, num_values)
 
             magnitude_data_db = []
             phase_data = []
             freq_data = []
+            # Software average over the last 8 sweeps
+            averager = SweepAverager(num_values, count=8)
 
             line_mag, = ax.plot([], [], label="Magnitude (dB)", color="blue")
             line_phase, = ax.plot([], [], label="Phase (radians)", color="orange")
 
-            ax.set_xlim(START_FREQ, START_FREQ + num_values * 2 * FREQ_STEP)
+            ax.set_xlim(START_FREQ, START_FREQ + num_values * FREQ_STEP)
             ax.set_ylim(-100, 100)
             ax.set_xlabel("Frequency (Hz)")
             ax.set_ylabel("Magnitude (dB) / Phase (radians)")
@@ -167,7 +126,7 @@ def main():
             ax.grid()
 
             ani = animation.FuncAnimation(
-                fig, update_plot, fargs=(ser, line_mag, line_phase, freq_data, magnitude_data_db, phase_data, num_values, START_FREQ, FREQ_STEP), interval=1000, blit=True
+                fig, update_plot, fargs=(ser, line_mag, line_phase, freq_data, magnitude_data_db, phase_data, num_values, START_FREQ, FREQ_STEP, averager), interval=1000, blit=True
             )
 
             plt.tight_layout()